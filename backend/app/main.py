@@ -2,7 +2,7 @@
 Receipt Tracker - FastAPI Backend
 Serves both the Vue.js frontend and REST API endpoints
 """
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Depends, Query
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, HTMLResponse
 from fastapi.middleware.cors import CORSMiddleware
@@ -13,6 +13,15 @@ from pathlib import Path
 
 from .routers import receipts, transactions, settings, auth, notifications
 from .services.database import connect_to_mongo, close_mongo_connection
+from .services.migrations import run_migrations, stop_migrations
+from .services.scan_queue import get_scan_queue
+from .services.metrics import get_metrics, loop_lag_monitor
+from .services.admin import get_current_admin_user_id
+from .services.uploads import (
+    upload_gc, UploadLimitMiddleware, MAX_UPLOAD_BYTES, MAX_BATCH_UPLOAD_BYTES, MULTIPART_OVERHEAD_BYTES
+)
+from .services.scan_stats import scan_stage_percentiles
+from .services.pagination import NEXT_CURSOR_HEADER
 
 # Static files directory
 STATIC_DIR = Path("/app/static")
@@ -23,13 +32,23 @@ async def lifespan(app: FastAPI):
     """Application lifespan manager"""
     # Startup
     await connect_to_mongo()
+    await run_migrations()
+    loop_lag_monitor.start()
     
     # Create admin user if environment variables are set
     from .init_admin import create_admin_user
     await create_admin_user()
     
+    # Start background receipt scan workers and upload garbage collection
+    await get_scan_queue().start()
+    upload_gc.start()
+    
     yield
     # Shutdown
+    await get_scan_queue().stop()
+    await upload_gc.stop()
+    await loop_lag_monitor.stop()
+    await stop_migrations()
     await close_mongo_connection()
 
 
@@ -47,6 +66,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"],
+)
+
+# Reject oversized uploads while they are received, not after spooling them to disk
+app.add_middleware(
+    UploadLimitMiddleware,
+    limits={
+        "/api/receipts/scan": MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES,
+        "/api/receipts/scan/batch": MAX_BATCH_UPLOAD_BYTES,
+    }
 )
 
 # API routes - these take priority
@@ -64,6 +93,21 @@ async def health_check():
     return {"status": "healthy", "service": "receipt-tracker"}
 
 
+@app.get("/api/metrics")
+async def runtime_metrics(admin_id: str = Depends(get_current_admin_user_id)):
+    """Runtime counters and gauges (admin only)"""
+    return get_metrics().snapshot()
+
+
+@app.get("/api/metrics/scans")
+async def scan_stage_metrics(
+    window: int = Query(3600, ge=60, le=30 * 24 * 3600, description="Window in seconds"),
+    admin_id: str = Depends(get_current_admin_user_id)
+):
+    """p50/p95/p99 per scan stage over recently finished scans (admin only)"""
+    return await scan_stage_percentiles(window)
+
+
 # Serve static files (JS, CSS, images, etc.)
 # This must be done AFTER API routes
 if STATIC_DIR.exists():
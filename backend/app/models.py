@@ -118,6 +118,8 @@ class SettingsModel(BaseModel):
     theme: str = "dark"  # "dark" or "light"
     budget_alerts: bool = True
     monthly_budget: Optional[float] = None
+    auto_create_transaction: bool = False  # Create transactions from completed scans
+    auto_create_min_confidence: float = 0.8
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     
     class Config:
@@ -15,6 +15,10 @@ from ..services.auth import (
 )
 from ..services.admin import get_current_admin_user_id
 from ..services.database import get_collection
+from ..services.uploads import release_user_blobs
+from ..services.category_index import get_category_index
+from ..services.category_cache import get_category_cache
+from ..services.data_versions import get_data_versions
 
 router = APIRouter()
 
@@ -206,5 +210,10 @@ async def admin_delete_user(
     await settings_collection.delete_many({"user_id": user_id})
     await categories_collection.delete_many({"user_id": user_id})
     await transactions_collection.delete_many({"user_id": user_id})
+    # Release receipt images so the upload collector can remove them
+    await release_user_blobs(user_id)
     await receipts_collection.delete_many({"user_id": user_id})
+    get_category_cache().invalidate(user_id)
+    get_category_index().invalidate(user_id)
+    await get_data_versions().bump(user_id)
 
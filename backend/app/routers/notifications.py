@@ -7,6 +7,7 @@ from fastapi import APIRouter, Depends, Query
 
 from ..services.auth import get_current_user_id
 from ..services.database import get_collection
+from ..services.search import WITHOUT_SEARCH_TERMS
 
 router = APIRouter()
 
@@ -93,7 +94,7 @@ async def list_notifications(
                 "date": {"$gte": today_dt, "$lte": latest_dt}
             }
         ]
-    })
+    }, WITHOUT_SEARCH_TERMS)
 
     # Fetch dismissed notification IDs
     dismissals_collection = await get_collection("notification_dismissals")
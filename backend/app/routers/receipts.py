@@ -1,153 +1,211 @@
 """
 Receipt scanning router
 """
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, status
+from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, status, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from datetime import datetime
 from bson import ObjectId
-import os
-import aiofiles
-from pathlib import Path
+from typing import List, Optional
+import asyncio
+import json
 
 from ..schemas import ReceiptScanResponse
-from ..services.auth import get_current_user_id
+from ..services.auth import get_current_user_id, decode_user_id, create_sse_ticket, SSE_TICKET_SCOPE, SSE_TICKET_EXPIRE_SECONDS
 from ..services.database import get_collection
-from ..services.ai_scanner import get_scanner
+from ..services.scan_queue import get_scan_queue, scan_batch
+from ..services.scan_cache import get_scan_cache
+from ..services.uploads import save_upload, save_batch
+from ..services.events import get_event_hub, publish_scan_status
+from ..services.receipt_transactions import insert_completed_receipt
+from ..services.category_index import attach_predicted_category
+from ..services.pagination import after_cursor, set_next_cursor
 
 router = APIRouter()
 
-# Upload directory
-UPLOAD_DIR = Path("/app/uploads")
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+# Bearer auth that lets the SSE endpoint fall back to a query ticket
+optional_security = HTTPBearer(auto_error=False)
+SSE_KEEPALIVE_SECONDS = 15
 
+# Newest first; _id breaks ties so keyset cursors are unambiguous
+RECEIPT_SORT = [("scanned_at", -1), ("_id", -1)]
 
-@router.post("/scan", response_model=ReceiptScanResponse)
+
+def receipt_to_response(receipt: dict) -> ReceiptScanResponse:
+    """Build the API response for a receipt document"""
+    return ReceiptScanResponse(
+        id=str(receipt["_id"]),
+        filename=receipt["filename"],
+        original_filename=receipt.get("original_filename"),
+        scan_status=receipt["scan_status"],
+        ai_confidence=receipt.get("ai_confidence"),
+        extracted_data=receipt.get("extracted_data"),
+        transaction_id=receipt.get("transaction_id"),
+        error_message=receipt.get("error_message"),
+        scanned_at=receipt["scanned_at"]
+    )
+
+
+@router.post("/scan", response_model=ReceiptScanResponse, status_code=status.HTTP_202_ACCEPTED)
 async def scan_receipt(
     file: UploadFile = File(...),
     user_id: str = Depends(get_current_user_id)
 ):
     """
-    Upload and scan a receipt image
+    Upload a receipt image and queue it for scanning
     
-    Uses Gemini 2.5 Flash Lite to extract transaction data
+    The receipt is stored as `pending` and returned immediately; background
+    workers extract the transaction data with Gemini 2.5 Flash Lite. Poll
+    `GET /api/receipts/{receipt_id}` for the result.
     """
-    # Validate file type
-    if not file.content_type.startswith("image/"):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="File must be an image"
-        )
-    
-    # Generate unique filename
-    timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-    file_ext = Path(file.filename).suffix
-    filename = f"{user_id}_{timestamp}{file_ext}"
-    file_path = UPLOAD_DIR / filename
+    # Stream file into content-addressed storage, hashing and validating it on the way
+    upload = await save_upload(file)
+    filename = upload.path.name
+    file_path = upload.path
+    digest = upload.content_hash
     
-    # Save file
-    async with aiofiles.open(file_path, 'wb') as out_file:
-        content = await file.read()
-        await out_file.write(content)
-    
-    # Create receipt record
     receipts_collection = await get_collection("receipts")
     receipt_doc = {
         "user_id": user_id,
         "filename": filename,
         "file_path": str(file_path),
-        "scan_status": "processing",
+        "content_hash": digest,
+        "scan_status": "pending",
         "scanned_at": datetime.utcnow()
     }
     
-    result = await receipts_collection.insert_one(receipt_doc)
-    receipt_id = str(result.inserted_id)
-    
-    # Scan with AI
-    try:
-        scanner = get_scanner()
-        
-        # Load user's API key from settings
+    # Identical image already scanned - reuse the stored result
+    cached = await get_scan_cache().get(digest)
+    if cached is not None:
+        cached = await attach_predicted_category(user_id, cached)
+        confidence = cached.get("confidence", 0.5)
+        receipt_doc.update({
+            "scan_status": "completed",
+            "ai_confidence": confidence,
+            "extracted_data": cached,
+            "cache_hit": True,
+            "completed_at": receipt_doc["scanned_at"]
+        })
         settings_collection = await get_collection("settings")
         user_settings = await settings_collection.find_one({"user_id": user_id})
-        
-        if user_settings and user_settings.get("gemini_api_key"):
-            scanner.set_api_key(user_settings["gemini_api_key"])
-        elif not scanner.api_key:
-            # No API key in settings and no default key
-            await receipts_collection.update_one(
-                {"_id": ObjectId(receipt_id)},
-                {"$set": {
-                    "scan_status": "failed",
-                    "error_message": "Gemini API key not configured. Please set it in settings."
-                }}
-            )
-            return ReceiptScanResponse(
-                id=receipt_id,
-                filename=filename,
-                scan_status="failed",
-                error_message="Gemini API key not configured. Please set it in settings.",
-                scanned_at=receipt_doc["scanned_at"]
-            )
-        
-        extracted_data = await scanner.scan_receipt(str(file_path))
-        
-        # Check for errors
-        if "error" in extracted_data:
-            await receipts_collection.update_one(
-                {"_id": ObjectId(receipt_id)},
-                {"$set": {
-                    "scan_status": "failed",
-                    "error_message": extracted_data["error"],
-                    "extracted_data": extracted_data
-                }}
-            )
-            
-            return ReceiptScanResponse(
-                id=receipt_id,
-                filename=filename,
-                scan_status="failed",
-                error_message=extracted_data["error"],
-                scanned_at=receipt_doc["scanned_at"]
-            )
-        
-        # Update receipt with extracted data
-        confidence = extracted_data.get("confidence", 0.5)
-        await receipts_collection.update_one(
-            {"_id": ObjectId(receipt_id)},
-            {"$set": {
-                "scan_status": "completed",
-                "ai_confidence": confidence,
-                "extracted_data": extracted_data
-            }}
-        )
-        
-        return ReceiptScanResponse(
-            id=receipt_id,
-            filename=filename,
-            scan_status="completed",
-            ai_confidence=confidence,
-            extracted_data=extracted_data,
-            scanned_at=receipt_doc["scanned_at"]
-        )
-        
-    except Exception as e:
-        # Update status to failed
-        error_msg = str(e)
-        await receipts_collection.update_one(
-            {"_id": ObjectId(receipt_id)},
-            {"$set": {
-                "scan_status": "failed",
-                "error_message": error_msg
-            }}
-        )
-        
-        # Return failed status instead of raising 500 error
-        return ReceiptScanResponse(
-            id=receipt_id,
-            filename=filename,
-            scan_status="failed",
-            error_message=f"Failed to scan receipt: {error_msg}",
-            scanned_at=receipt_doc["scanned_at"]
+        await insert_completed_receipt(receipt_doc, user_settings)
+        publish_scan_status(receipt_doc)
+        return receipt_to_response(receipt_doc)
+    
+    # Create receipt record; the scan queue picks it up from here
+    result = await receipts_collection.insert_one(receipt_doc)
+    publish_scan_status(receipt_doc)
+    get_scan_queue().notify()
+    
+    return ReceiptScanResponse(
+        id=str(result.inserted_id),
+        filename=filename,
+        scan_status="pending",
+        scanned_at=receipt_doc["scanned_at"]
+    )
+
+
+@router.post("/scan/batch")
+async def scan_receipt_batch(
+    files: List[UploadFile] = File(...),
+    user_id: str = Depends(get_current_user_id)
+):
+    """
+    Upload and scan many receipt images at once
+    
+    Accepts several image files or a single zip archive of images. Scans
+    run concurrently and the response streams one NDJSON line per receipt
+    as soon as its scan finishes; files that fail validation are reported
+    with `scan_status: "rejected"`.
+    """
+    stored = await save_batch(files)
+    
+    # Insert receipts as already claimed so queue workers leave them alone
+    now = datetime.utcnow()
+    receipt_docs = [
+        {
+            "user_id": user_id,
+            "filename": item.upload.path.name,
+            "original_filename": item.original_name,
+            "file_path": str(item.upload.path),
+            "content_hash": item.upload.content_hash,
+            "scan_status": "processing",
+            "processing_started_at": now,
+            "attempts": 1,
+            "scanned_at": now
+        }
+        for item in stored if item.upload is not None
+    ]
+    if receipt_docs:
+        receipts_collection = await get_collection("receipts")
+        await receipts_collection.insert_many(receipt_docs)
+    
+    async def stream_results():
+        for item in stored:
+            if item.upload is None:
+                yield json.dumps({
+                    "original_filename": item.original_name,
+                    "scan_status": "rejected",
+                    "error_message": item.error
+                }) + "\n"
+        async for receipt in scan_batch(receipt_docs):
+            yield receipt_to_response(receipt).model_dump_json() + "\n"
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+
+@router.post("/events/ticket")
+async def receipt_events_ticket(user_id: str = Depends(get_current_user_id)):
+    """Short-lived ticket for opening the event stream from a browser"""
+    return {"ticket": create_sse_ticket(user_id), "expires_in": SSE_TICKET_EXPIRE_SECONDS}
+
+
+@router.get("/events")
+async def receipt_events(
+    request: Request,
+    ticket: Optional[str] = Query(None),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    """
+    Server-Sent Events stream of the user's receipt `scan_status` changes
+    
+    Sends a `scan_status` event whenever a receipt becomes pending,
+    processing, completed or failed. Browsers' EventSource cannot set
+    headers, so they pass a ticket from `POST /events/ticket` as `?ticket=`
+    instead; access tokens are never accepted in the URL.
+    """
+    if credentials:
+        user_id = decode_user_id(credentials.credentials)
+    elif ticket:
+        user_id = decode_user_id(ticket, scope=SSE_TICKET_SCOPE)
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
         )
+    
+    hub = get_event_hub()
+    queue = hub.subscribe(user_id)
+    
+    async def stream_events():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+        finally:
+            hub.unsubscribe(user_id, queue)
+    
+    return StreamingResponse(
+        stream_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @router.get("/{receipt_id}", response_model=ReceiptScanResponse)
@@ -169,34 +227,38 @@ async def get_receipt(
             detail="Receipt not found"
         )
     
-    return ReceiptScanResponse(
-        id=str(receipt["_id"]),
-        filename=receipt["filename"],
-        scan_status=receipt["scan_status"],
-        ai_confidence=receipt.get("ai_confidence"),
-        extracted_data=receipt.get("extracted_data"),
-        transaction_id=receipt.get("transaction_id"),
-        error_message=receipt.get("error_message"),
-        scanned_at=receipt["scanned_at"]
-    )
+    return receipt_to_response(receipt)
 
 
 @router.get("/")
 async def list_receipts(
+    response: Response,
     user_id: str = Depends(get_current_user_id),
+    cursor: Optional[str] = None,
     skip: int = 0,
-    limit: int = 50
+    limit: int = Query(50, ge=1, le=1000)
 ):
-    """List all receipt scans for user"""
+    """
+    List all receipt scans for user
+    
+    Pass the `X-Next-Cursor` response header back as `cursor` to fetch the
+    next page; `skip` is still supported but gets slower with depth.
+    """
     receipts_collection = await get_collection("receipts")
     
-    cursor = receipts_collection.find({"user_id": user_id}) \
-        .sort("scanned_at", -1) \
+    query = {"user_id": user_id}
+    if cursor:
+        query = after_cursor(query, RECEIPT_SORT, cursor)
+        skip = 0
+    docs = await receipts_collection.find(query) \
+        .sort(RECEIPT_SORT) \
         .skip(skip) \
-        .limit(limit)
+        .limit(limit) \
+        .to_list(length=limit)
+    set_next_cursor(response, docs, RECEIPT_SORT, limit)
     
     receipts = []
-    async for receipt in cursor:
+    for receipt in docs:
         receipts.append({
             "id": str(receipt["_id"]),
             "filename": receipt["filename"],
@@ -1,14 +1,19 @@
 """
 Settings router for app configuration
 """
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
 from datetime import datetime
 from bson import ObjectId
 
 from ..schemas import SettingsUpdate, SettingsResponse, CategoryCreate, CategoryUpdate, CategoryResponse
 from ..services.auth import get_current_user_id
 from ..services.database import get_collection
-from ..services.ai_scanner import get_scanner
+from ..services.ai_scanner import get_scanner_pool
+from ..services.receipt_transactions import DEFAULT_AUTO_CREATE_MIN_CONFIDENCE
+from ..services.category_index import get_category_index
+from ..services.category_cache import get_category_cache
+from ..services.data_versions import get_data_versions, user_etag, not_modified, set_etag
+from ..services.search import with_search_terms, WITHOUT_SEARCH_TERMS
 
 router = APIRouter()
 
@@ -48,6 +53,8 @@ async def get_settings(user_id: str = Depends(get_current_user_id)):
         theme=settings.get("theme", "dark"),
         budget_alerts=settings.get("budget_alerts", True),
         monthly_budget=settings.get("monthly_budget"),
+        auto_create_transaction=settings.get("auto_create_transaction", False),
+        auto_create_min_confidence=settings.get("auto_create_min_confidence", DEFAULT_AUTO_CREATE_MIN_CONFIDENCE),
         has_gemini_api_key=bool(settings.get("gemini_api_key"))
     )
 
@@ -63,9 +70,10 @@ async def update_settings(
     update_doc = {}
     if updates.gemini_api_key is not None:
         update_doc["gemini_api_key"] = updates.gemini_api_key
-        # Update AI scanner with new key
-        scanner = get_scanner()
-        scanner.set_api_key(updates.gemini_api_key)
+        # Drop the pooled scanner for the key being replaced
+        current = await settings_collection.find_one({"user_id": user_id}, {"gemini_api_key": 1})
+        if current and current.get("gemini_api_key") != updates.gemini_api_key:
+            get_scanner_pool().invalidate(current.get("gemini_api_key"))
     
     if updates.default_currency is not None:
         update_doc["default_currency"] = updates.default_currency
@@ -75,6 +83,10 @@ async def update_settings(
         update_doc["budget_alerts"] = updates.budget_alerts
     if updates.monthly_budget is not None:
         update_doc["monthly_budget"] = updates.monthly_budget
+    if updates.auto_create_transaction is not None:
+        update_doc["auto_create_transaction"] = updates.auto_create_transaction
+    if updates.auto_create_min_confidence is not None:
+        update_doc["auto_create_min_confidence"] = updates.auto_create_min_confidence
     
     # Update settings - use $setOnInsert to set user_id on new docs
     result = await settings_collection.find_one_and_update(
@@ -92,19 +104,23 @@ async def update_settings(
         theme=result.get("theme", "dark"),
         budget_alerts=result.get("budget_alerts", True),
         monthly_budget=result.get("monthly_budget"),
+        auto_create_transaction=result.get("auto_create_transaction", False),
+        auto_create_min_confidence=result.get("auto_create_min_confidence", DEFAULT_AUTO_CREATE_MIN_CONFIDENCE),
         has_gemini_api_key=bool(result.get("gemini_api_key"))
     )
 
 
 # Category management endpoints
 @router.get("/categories")
-async def list_categories(user_id: str = Depends(get_current_user_id)):
-    """List all categories for user"""
-    categories_collection = await get_collection("categories")
-    
-    cursor = categories_collection.find({"user_id": user_id})
+async def list_categories(request: Request, response: Response, user_id: str = Depends(get_current_user_id)):
+    """List all categories for user (304 on a matching `If-None-Match`)"""
+    etag = await user_etag(user_id)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    set_etag(response, etag)
     categories = []
-    async for cat in cursor:
+    for cat in (await get_category_cache().get_all(user_id)).values():
         categories.append(CategoryResponse(
             id=str(cat["_id"]),
             name=cat["name"],
@@ -133,6 +149,8 @@ async def create_category(
     }
     
     result = await categories_collection.insert_one(category_doc)
+    get_category_cache().invalidate(user_id)
+    await get_data_versions().bump(user_id)
     
     return CategoryResponse(
         id=str(result.inserted_id),
@@ -177,6 +195,13 @@ async def update_category(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Category not found"
         )
+    cache = get_category_cache()
+    cache.invalidate(user_id)
+    await get_data_versions().bump(user_id)
+    if "name" in update_doc:
+        # Transactions and the merchant index carry the name denormalized
+        cache.rename(user_id, category_id, update_doc["name"])
+        get_category_index().invalidate(user_id)
     
     return CategoryResponse(
         id=str(result["_id"]),
@@ -205,6 +230,9 @@ async def delete_category(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Category not found"
         )
+    get_category_cache().invalidate(user_id)
+    get_category_index().invalidate(user_id)
+    await get_data_versions().bump(user_id)
 
 
 @router.get("/export")
@@ -219,7 +247,9 @@ async def export_user_data(user_id: str = Depends(get_current_user_id)):
         "default_currency": settings.get("default_currency", "€"),
         "theme": settings.get("theme", "dark"),
         "budget_alerts": settings.get("budget_alerts", True),
-        "monthly_budget": settings.get("monthly_budget")
+        "monthly_budget": settings.get("monthly_budget"),
+        "auto_create_transaction": settings.get("auto_create_transaction", False),
+        "auto_create_min_confidence": settings.get("auto_create_min_confidence", DEFAULT_AUTO_CREATE_MIN_CONFIDENCE)
     }
 
     categories = []
@@ -234,7 +264,7 @@ async def export_user_data(user_id: str = Depends(get_current_user_id)):
         })
 
     transactions = []
-    txn_cursor = transactions_collection.find({"user_id": user_id})
+    txn_cursor = transactions_collection.find({"user_id": user_id}, WITHOUT_SEARCH_TERMS)
     async for txn in txn_cursor:
         transactions.append({
             "id": str(txn["_id"]),
@@ -290,7 +320,9 @@ async def import_user_data(
                 "default_currency": settings.get("default_currency", "€"),
                 "theme": settings.get("theme", "dark"),
                 "budget_alerts": settings.get("budget_alerts", True),
-                "monthly_budget": settings.get("monthly_budget")
+                "monthly_budget": settings.get("monthly_budget"),
+                "auto_create_transaction": settings.get("auto_create_transaction", False),
+                "auto_create_min_confidence": settings.get("auto_create_min_confidence", DEFAULT_AUTO_CREATE_MIN_CONFIDENCE)
             },
             "$setOnInsert": {"user_id": user_id}
         },
@@ -342,9 +374,14 @@ async def import_user_data(
             "created_at": created_at,
             "updated_at": updated_at
         }
-        await transactions_collection.insert_one(txn_doc)
+        await transactions_collection.insert_one(with_search_terms(txn_doc))
         imported_txn_count += 1
 
+    # Category ids were remapped - reload categories and the merchant index on next use
+    get_category_cache().invalidate(user_id)
+    get_category_index().invalidate(user_id)
+    await get_data_versions().bump(user_id)
+
     return {
         "status": "ok",
         "categories_imported": len(categories),
@@ -1,21 +1,44 @@
 """
 Transactions router for CRUD operations
 """
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from datetime import datetime
 from bson import ObjectId
-from typing import Optional, List
+from pymongo import ReturnDocument, InsertOne, UpdateOne, DeleteOne
+from pymongo.errors import BulkWriteError
+from typing import Optional, List, Set
+from pydantic import TypeAdapter
+import csv
+import io
+import json
+import os
 
 from ..schemas import (
     TransactionCreate,
     TransactionUpdate,
     TransactionResponse,
+    TransactionListItem,
+    TransactionSearchResult,
+    TransactionFacets,
+    BulkTransactionRequest,
+    BulkTransactionResponse,
+    BulkOperationResult,
     AnalyticsResponse,
     PeriodStats,
     CategoryBreakdown
 )
 from ..services.auth import get_current_user_id
 from ..services.database import get_collection
+from ..services.category_index import get_category_index
+from ..services.category_cache import get_category_cache
+from ..services.data_versions import get_data_versions, user_etag, not_modified, set_etag
+from ..services.facets import transaction_facets
+from ..services.pagination import after_cursor, set_next_cursor
+from ..services.search import (
+    find_matching_transactions, with_search_terms, touches_search_fields, search_terms,
+    SEARCH_SOURCE_PROJECTION, WITHOUT_SEARCH_TERMS
+)
 from ..services.analytics import (
     calculate_period_stats,
     calculate_category_breakdown,
@@ -24,27 +47,129 @@ from ..services.analytics import (
 
 router = APIRouter()
 
+# Newest first; _id breaks ties so keyset cursors are unambiguous
+TRANSACTION_SORT = [("date", -1), ("created_at", -1), ("_id", -1)]
 
-@router.post("/", response_model=TransactionResponse, status_code=status.HTTP_201_CREATED)
-async def create_transaction(
-    transaction: TransactionCreate,
-    user_id: str = Depends(get_current_user_id)
-):
+# Documents fetched per round trip (and rows written per chunk) when streaming
+TRANSACTION_STREAM_BATCH_SIZE = int(os.getenv("TRANSACTION_STREAM_BATCH_SIZE", "500"))
+
+# Fields selectable with `fields=`; lists leave out `items` unless asked
+LIST_FIELDS: Set[str] = set(TransactionListItem.model_fields)
+DEFAULT_LIST_FIELDS: Set[str] = LIST_FIELDS - {"items"}
+_LIST_DEFAULTS = {"currency": "€", "items": [], "tags": [], "is_recurring": False, "recurring_interval": 1}
+
+_LIST_ADAPTER = TypeAdapter(List[TransactionListItem])
+_SEARCH_ADAPTER = TypeAdapter(List[TransactionSearchResult])
+
+
+def _parse_fields(fields: Optional[str]) -> Set[str]:
+    """Resolve the `fields=` parameter ("all" selects every field)"""
+    if not fields:
+        return DEFAULT_LIST_FIELDS
+    if fields == "all":
+        return LIST_FIELDS
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - LIST_FIELDS
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(sorted(unknown))}"
+        )
+    return requested | {"id"}
+
+
+def _list_projection(fields: Set[str]) -> dict:
+    """Mongo projection for the selected fields, so unused BSON is never decoded"""
+    projection = {field: 1 for field in fields - {"id", "item_count"}}
+    # Sort keys are always needed for the next-page cursor
+    projection.update({"date": 1, "created_at": 1})
+    if "item_count" in fields:
+        projection["item_count"] = {"$size": {"$ifNull": ["$items", []]}}
+    return projection
+
+
+def _list_query(
+    user_id: str,
+    transaction_type: Optional[str],
+    category_id: Optional[str],
+    start_date: Optional[datetime],
+    end_date: Optional[datetime],
+    is_recurring: Optional[bool],
+    include_future: bool
+) -> dict:
+    """Mongo filter for the list filters (future dates are cut off unless included)"""
+    query = {"user_id": user_id}
+    if transaction_type:
+        query["type"] = transaction_type
+    if category_id:
+        query["category_id"] = category_id
+    now = datetime.utcnow()
+    if not include_future:
+        if end_date is None or end_date > now:
+            end_date = now
+
+    if start_date or end_date:
+        date_query = {}
+        if start_date:
+            date_query["$gte"] = start_date
+        if end_date:
+            date_query["$lte"] = end_date
+        query["date"] = date_query
+    if is_recurring is not None:
+        query["is_recurring"] = is_recurring
+    return query
+
+
+def _list_values(txn: dict, fields: Set[str]) -> dict:
+    row = {"id": str(txn["_id"])}
+    for field in fields - {"id"}:
+        row[field] = txn.get(field, _LIST_DEFAULTS.get(field))
+    return row
+
+
+def _json_rows(adapter: TypeAdapter, rows: List[dict]) -> Response:
     """
-    Create a new transaction manually or from receipt scan
+    Serialize list rows in a single pass
+
+    The whole list is validated and dumped to JSON bytes by a prebuilt
+    adapter, skipping FastAPI's per-row model construction, re-validation
+    against `response_model` and `jsonable_encoder` walk. The route keeps its
+    `response_model` for the OpenAPI schema; the bytes are the same.
     """
-    transactions_collection = await get_collection("transactions")
-    categories_collection = await get_collection("categories")
-    
-    # Get category name if category_id provided
-    category_name = None
-    if transaction.category_id:
-        category = await categories_collection.find_one({"_id": ObjectId(transaction.category_id)})
-        if category:
-            category_name = category["name"]
-    
-    # Build transaction document
-    txn_doc = {
+    return Response(
+        content=adapter.dump_json(adapter.validate_python(rows), exclude_unset=True),
+        media_type="application/json"
+    )
+
+
+def transaction_to_response(txn: dict) -> TransactionResponse:
+    """Build the API response for a transaction document"""
+    return TransactionResponse(
+        id=str(txn["_id"]),
+        type=txn["type"],
+        amount=txn["amount"],
+        currency=txn.get("currency", "€"),
+        category_id=txn.get("category_id"),
+        category_name=txn.get("category_name"),
+        merchant_name=txn.get("merchant_name"),
+        description=txn.get("description"),
+        date=txn["date"],
+        items=txn.get("items", []),
+        receipt_id=txn.get("receipt_id"),
+        tags=txn.get("tags", []),
+        is_recurring=txn.get("is_recurring", False),
+        recurring_frequency=txn.get("recurring_frequency"),
+        recurring_interval=txn.get("recurring_interval", 1),
+        recurring_end_date=txn.get("recurring_end_date"),
+        created_at=txn["created_at"],
+        updated_at=txn["updated_at"]
+    )
+
+
+def _transaction_doc(user_id: str, transaction: TransactionCreate, category_name: Optional[str]) -> dict:
+    """Build a new transaction document"""
+    now = datetime.utcnow()
+    return with_search_terms({
         "user_id": user_id,
         "type": transaction.type,
         "amount": transaction.amount,
@@ -60,36 +185,75 @@ async def create_transaction(
         "recurring_frequency": transaction.recurring_frequency,
         "recurring_interval": transaction.recurring_interval,
         "recurring_end_date": transaction.recurring_end_date,
-        "created_at": datetime.utcnow(),
-        "updated_at": datetime.utcnow()
-    }
+        "created_at": now,
+        "updated_at": now
+    })
+
+
+def _update_doc(updates: TransactionUpdate, category_name: Optional[str]) -> dict:
+    """Build the `$set` document for the fields present in an update"""
+    update_doc = {"updated_at": datetime.utcnow()}
+    if updates.type is not None:
+        update_doc["type"] = updates.type
+    if updates.amount is not None:
+        update_doc["amount"] = updates.amount
+    if updates.currency is not None:
+        update_doc["currency"] = updates.currency
+    if updates.category_id is not None:
+        update_doc["category_id"] = updates.category_id
+        if category_name is not None:
+            update_doc["category_name"] = category_name
+    if updates.merchant_name is not None:
+        update_doc["merchant_name"] = updates.merchant_name
+    if updates.description is not None:
+        update_doc["description"] = updates.description
+    if updates.date is not None:
+        update_doc["date"] = updates.date
+    if updates.items is not None:
+        update_doc["items"] = [item.dict() for item in updates.items]
+    if updates.tags is not None:
+        update_doc["tags"] = updates.tags
+    if updates.is_recurring is not None:
+        update_doc["is_recurring"] = updates.is_recurring
+    if updates.recurring_frequency is not None:
+        update_doc["recurring_frequency"] = updates.recurring_frequency
+    if updates.recurring_interval is not None:
+        update_doc["recurring_interval"] = updates.recurring_interval
+    if updates.recurring_end_date is not None:
+        update_doc["recurring_end_date"] = updates.recurring_end_date
+    return update_doc
+
+
+@router.post("/", response_model=TransactionResponse, status_code=status.HTTP_201_CREATED)
+async def create_transaction(
+    transaction: TransactionCreate,
+    user_id: str = Depends(get_current_user_id)
+):
+    """
+    Create a new transaction manually or from receipt scan
+    """
+    transactions_collection = await get_collection("transactions")
+    
+    # Get category name if category_id provided
+    category_name = None
+    category = await get_category_cache().get(user_id, transaction.category_id)
+    if category:
+        category_name = category["name"]
+    
+    # Build transaction document
+    txn_doc = _transaction_doc(user_id, transaction, category_name)
     
     result = await transactions_collection.insert_one(txn_doc)
     txn_doc["_id"] = result.inserted_id
+    get_category_index().record(user_id, txn_doc["merchant_name"], txn_doc["category_id"], category_name)
+    await get_data_versions().bump(user_id)
     
-    return TransactionResponse(
-        id=str(txn_doc["_id"]),
-        type=txn_doc["type"],
-        amount=txn_doc["amount"],
-        currency=txn_doc["currency"],
-        category_id=txn_doc.get("category_id"),
-        category_name=txn_doc.get("category_name"),
-        merchant_name=txn_doc.get("merchant_name"),
-        description=txn_doc.get("description"),
-        date=txn_doc["date"],
-        items=txn_doc.get("items", []),
-        tags=txn_doc.get("tags", []),
-        is_recurring=txn_doc["is_recurring"],
-        recurring_frequency=txn_doc.get("recurring_frequency"),
-        recurring_interval=txn_doc.get("recurring_interval", 1),
-        recurring_end_date=txn_doc.get("recurring_end_date"),
-        created_at=txn_doc["created_at"],
-        updated_at=txn_doc["updated_at"]
-    )
+    return transaction_to_response(txn_doc)
 
 
-@router.get("/", response_model=List[TransactionResponse])
+@router.get("/", response_model=List[TransactionListItem], response_model_exclude_unset=True)
 async def list_transactions(
+    request: Request,
     user_id: str = Depends(get_current_user_id),
     transaction_type: Optional[str] = Query(None, regex="^(expense|income)$"),
     category_id: Optional[str] = None,
@@ -97,65 +261,293 @@ async def list_transactions(
     end_date: Optional[datetime] = None,
     is_recurring: Optional[bool] = None,
     include_future: bool = Query(False),
+    fields: Optional[str] = Query(None, description="Comma-separated fields, or 'all'"),
+    cursor: Optional[str] = None,
     skip: int = 0,
-    limit: int = 100
+    limit: int = Query(100, ge=1, le=1000)
 ):
     """
     List transactions with optional filters
+    
+    Pass the `X-Next-Cursor` response header back as `cursor` to fetch the
+    next page; `skip` is still supported but gets slower with depth.
+    
+    Rows carry every field except `items` (use `item_count` and fetch the
+    transaction for its items) unless `fields` selects otherwise.
+    
+    Answers `If-None-Match` with 304 while the user's data is unchanged.
     """
+    selected = _parse_fields(fields)
+    etag = await user_etag(user_id)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
     transactions_collection = await get_collection("transactions")
-    
-    # Build query
-    query = {"user_id": user_id}
-    if transaction_type:
-        query["type"] = transaction_type
-    if category_id:
-        query["category_id"] = category_id
-    now = datetime.utcnow()
-    if not include_future:
-        if end_date is None or end_date > now:
-            end_date = now
-
-    if start_date or end_date:
-        date_query = {}
-        if start_date:
-            date_query["$gte"] = start_date
-        if end_date:
-            date_query["$lte"] = end_date
-        query["date"] = date_query
-    if is_recurring is not None:
-        query["is_recurring"] = is_recurring
+    query = _list_query(user_id, transaction_type, category_id, start_date, end_date, is_recurring, include_future)
     
     # Execute query - sort by date desc, then by created_at desc for same-day transactions
-    cursor = transactions_collection.find(query) \
-        .sort([("date", -1), ("created_at", -1)]) \
+    if cursor:
+        query = after_cursor(query, TRANSACTION_SORT, cursor)
+        skip = 0
+    docs = await transactions_collection.find(query, _list_projection(selected)) \
+        .sort(TRANSACTION_SORT) \
         .skip(skip) \
-        .limit(limit)
+        .limit(limit) \
+        .to_list(length=limit)
+    response = _json_rows(_LIST_ADAPTER, [_list_values(txn, selected) for txn in docs])
+    set_next_cursor(response, docs, TRANSACTION_SORT, limit)
+    set_etag(response, etag)
+    return response
+
+
+def _ndjson_chunk(rows: List[dict]) -> str:
+    """NDJSON lines for a batch of list rows"""
+    return "".join(row.model_dump_json(exclude_unset=True) + "\n" for row in _LIST_ADAPTER.validate_python(rows))
+
+
+def _csv_chunk(rows: List[dict], columns: List[str]) -> str:
+    """CSV lines for a batch of list rows; list cells (tags, items) hold JSON"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in _LIST_ADAPTER.validate_python(rows):
+        values = row.model_dump(mode="json")
+        writer.writerow([
+            json.dumps(values[column], ensure_ascii=False) if isinstance(values[column], list)
+            else "" if values[column] is None
+            else values[column]
+            for column in columns
+        ])
+    return buffer.getvalue()
+
+
+@router.get("/stream", response_class=StreamingResponse)
+async def stream_transactions(
+    user_id: str = Depends(get_current_user_id),
+    transaction_type: Optional[str] = Query(None, regex="^(expense|income)$"),
+    category_id: Optional[str] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    is_recurring: Optional[bool] = None,
+    include_future: bool = Query(False),
+    fields: Optional[str] = Query(None, description="Comma-separated fields, or 'all'"),
+    output_format: str = Query("ndjson", alias="format", regex="^(ndjson|csv)$")
+):
+    """
+    Stream every matching transaction as NDJSON or CSV
     
-    transactions = []
-    async for txn in cursor:
-        transactions.append(TransactionResponse(
-            id=str(txn["_id"]),
-            type=txn["type"],
-            amount=txn["amount"],
-            currency=txn.get("currency", "€"),
-            category_id=txn.get("category_id"),
-            category_name=txn.get("category_name"),
-            merchant_name=txn.get("merchant_name"),
-            description=txn.get("description"),
-            date=txn["date"],
-            items=txn.get("items", []),
-            receipt_id=txn.get("receipt_id"),
-            tags=txn.get("tags", []),
-            is_recurring=txn.get("is_recurring", False),
-            recurring_frequency=txn.get("recurring_frequency"),
-            recurring_interval=txn.get("recurring_interval", 1),
-            recurring_end_date=txn.get("recurring_end_date"),
-            created_at=txn["created_at"],
-            updated_at=txn["updated_at"]
-        ))
-    
-    return transactions
+    Takes the filters and `fields` of the list endpoint but has no limit.
+    Documents are read in batches of TRANSACTION_STREAM_BATCH_SIZE and each
+    batch is written before the next is fetched, so server memory stays flat
+    however large the date range is.
+    """
+    selected = _parse_fields(fields)
+    columns = [field for field in TransactionListItem.model_fields if field in selected]
+    transactions_collection = await get_collection("transactions")
+    query = _list_query(user_id, transaction_type, category_id, start_date, end_date, is_recurring, include_future)
+    cursor = transactions_collection.find(query, _list_projection(selected)) \
+        .sort(TRANSACTION_SORT) \
+        .batch_size(TRANSACTION_STREAM_BATCH_SIZE)
+    
+    if output_format == "csv":
+        encode = lambda rows: _csv_chunk(rows, columns)
+        media_type = "text/csv"
+    else:
+        encode = _ndjson_chunk
+        media_type = "application/x-ndjson"
+    
+    async def stream_rows():
+        try:
+            if output_format == "csv":
+                buffer = io.StringIO()
+                csv.writer(buffer).writerow(columns)
+                yield buffer.getvalue()
+            rows = []
+            async for txn in cursor:
+                rows.append(_list_values(txn, selected))
+                if len(rows) >= TRANSACTION_STREAM_BATCH_SIZE:
+                    yield encode(rows)
+                    rows = []
+            if rows:
+                yield encode(rows)
+        finally:
+            # Also reached when the client disconnects mid-stream
+            await cursor.close()
+    
+    return StreamingResponse(
+        stream_rows(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="transactions.{output_format}"'}
+    )
+
+
+@router.post("/bulk", response_model=BulkTransactionResponse)
+async def bulk_write_transactions(
+    request: BulkTransactionRequest,
+    user_id: str = Depends(get_current_user_id)
+):
+    """
+    Create, update and delete many transactions in one request
+    
+    All referenced categories are resolved with one query and all writes go
+    to MongoDB as one unordered bulk write, so one failing operation does
+    not stop the others. Each operation gets its own result, in request order.
+    """
+    transactions_collection = await get_collection("transactions")
+    results: List[Optional[BulkOperationResult]] = [None] * len(request.operations)
+    creates = {}
+    updates = {}
+    deletes = {}
+    seen_ids = set()
+    
+    def fail(index: int, op: str, error: str, outcome: str = "error", txn_id: Optional[str] = None):
+        results[index] = BulkOperationResult(index=index, op=op, status=outcome, id=txn_id, error=error)
+    
+    # Validate every operation up front; invalid ones are reported, not fatal
+    for index, operation in enumerate(request.operations):
+        try:
+            if operation.op == "create":
+                creates[index] = TransactionCreate.model_validate(operation.data or {})
+                continue
+            if not operation.id or not ObjectId.is_valid(operation.id):
+                raise ValueError("A valid transaction id is required")
+            if operation.id in seen_ids:
+                raise ValueError("Transaction appears more than once in the batch")
+            seen_ids.add(operation.id)
+            if operation.op == "update":
+                updates[index] = (ObjectId(operation.id), TransactionUpdate.model_validate(operation.data or {}))
+            else:
+                deletes[index] = ObjectId(operation.id)
+        except ValueError as e:
+            fail(index, operation.op, str(e), txn_id=operation.id)
+    
+    # One query for all categories and one for all rows being changed
+    category_names = await get_category_cache().names(
+        user_id,
+        [txn.category_id for txn in creates.values()] + [upd.category_id for _, upd in updates.values()]
+    )
+    target_ids = [oid for oid, _ in updates.values()] + list(deletes.values())
+    existing = {}
+    if target_ids:
+        cursor = transactions_collection.find(
+            {"_id": {"$in": target_ids}, "user_id": user_id},
+            {"merchant_name": 1, "category_id": 1, "category_name": 1, "description": 1, "tags": 1, "items.name": 1}
+        )
+        existing = {doc["_id"]: doc async for doc in cursor}
+    
+    writes = []
+    positions = []  # Request index of each write
+    after = {}  # Request index -> document state after the write
+    for index, txn in creates.items():
+        doc = _transaction_doc(user_id, txn, category_names.get(txn.category_id))
+        doc["_id"] = ObjectId()
+        writes.append(InsertOne(doc))
+        positions.append(index)
+        after[index] = doc
+    for index, (oid, upd) in updates.items():
+        if oid not in existing:
+            fail(index, "update", "Transaction not found", "not_found", str(oid))
+            continue
+        update_doc = _update_doc(upd, category_names.get(upd.category_id))
+        if touches_search_fields(update_doc):
+            update_doc["search_terms"] = search_terms({**existing[oid], **update_doc})
+        writes.append(UpdateOne({"_id": oid, "user_id": user_id}, {"$set": update_doc}))
+        positions.append(index)
+        after[index] = {**existing[oid], **update_doc}
+    for index, oid in deletes.items():
+        if oid not in existing:
+            fail(index, "delete", "Transaction not found", "not_found", str(oid))
+            continue
+        writes.append(DeleteOne({"_id": oid, "user_id": user_id}))
+        positions.append(index)
+    
+    write_errors = {}
+    if writes:
+        try:
+            await transactions_collection.bulk_write(writes, ordered=False)
+        except BulkWriteError as e:
+            write_errors = {
+                positions[error["index"]]: error.get("errmsg", "Write failed")
+                for error in e.details.get("writeErrors", [])
+            }
+    
+    merchant_index = get_category_index()
+    done_status = {"create": "created", "update": "updated", "delete": "deleted"}
+    for index in positions:
+        operation = request.operations[index]
+        if index in write_errors:
+            fail(index, operation.op, write_errors[index], txn_id=operation.id)
+            continue
+        if operation.op == "create":
+            doc = after[index]
+            txn_id = str(doc["_id"])
+            merchant_index.record(user_id, doc["merchant_name"], doc["category_id"], doc["category_name"])
+        else:
+            txn_id = operation.id
+            previous = existing[ObjectId(txn_id)]
+            merchant_index.record(user_id, previous.get("merchant_name"), previous.get("category_id"), delta=-1)
+            if operation.op == "update":
+                doc = after[index]
+                merchant_index.record(user_id, doc.get("merchant_name"), doc.get("category_id"), doc.get("category_name"))
+        results[index] = BulkOperationResult(index=index, op=operation.op, status=done_status[operation.op], id=txn_id)
+    
+    counts = {outcome: 0 for outcome in ("created", "updated", "deleted")}
+    failed = 0
+    for result in results:
+        if result.status in counts:
+            counts[result.status] += 1
+        else:
+            failed += 1
+    if failed < len(results):
+        await get_data_versions().bump(user_id)
+    return BulkTransactionResponse(results=results, failed=failed, **counts)
+
+
+@router.get("/facets", response_model=TransactionFacets)
+async def get_transaction_facets(
+    request: Request,
+    response: Response,
+    user_id: str = Depends(get_current_user_id),
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    transaction_type: Optional[str] = Query(None, regex="^(expense|income)$"),
+    top: int = Query(10, ge=1, le=100)
+):
+    """
+    Top tags, merchants and categories in a date range
+    
+    Each bucket has the number of transactions and the expense and income
+    totals. The range never extends past now, like the list and analytics,
+    so future-dated transactions are left out. Answers `If-None-Match`
+    with 304 while the user's data is unchanged.
+    """
+    etag = await user_etag(user_id)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    set_etag(response, etag)
+    
+    facets = await transaction_facets(user_id, start_date, end_date, transaction_type, top)
+    return TransactionFacets(start_date=start_date, end_date=end_date, **facets)
+
+
+@router.get("/search", response_model=List[TransactionSearchResult], response_model_exclude_unset=True)
+async def search_transactions(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(50, ge=1, le=200),
+    user_id: str = Depends(get_current_user_id)
+):
+    """
+    Search transactions by merchant, description, tags and item names
+    
+    Every word of `q` must match the start of a word in one of those fields.
+    Results are ranked by where the words matched (merchant first, then tags,
+    items and description; whole words above prefixes), newest first on ties.
+    """
+    matches = await find_matching_transactions(user_id, q, limit, _list_projection(DEFAULT_LIST_FIELDS))
+    return _json_rows(
+        _SEARCH_ADAPTER,
+        [{**_list_values(txn, DEFAULT_LIST_FIELDS), "score": score} for txn, score in matches]
+    )
 
 
 @router.get("/{transaction_id}", response_model=TransactionResponse)
@@ -169,7 +561,7 @@ async def get_transaction(
     txn = await transactions_collection.find_one({
         "_id": ObjectId(transaction_id),
         "user_id": user_id
-    })
+    }, WITHOUT_SEARCH_TERMS)
     
     if not txn:
         raise HTTPException(
@@ -177,26 +569,7 @@ async def get_transaction(
             detail="Transaction not found"
         )
     
-    return TransactionResponse(
-        id=str(txn["_id"]),
-        type=txn["type"],
-        amount=txn["amount"],
-        currency=txn.get("currency", "€"),
-        category_id=txn.get("category_id"),
-        category_name=txn.get("category_name"),
-        merchant_name=txn.get("merchant_name"),
-        description=txn.get("description"),
-        date=txn["date"],
-        items=txn.get("items", []),
-        receipt_id=txn.get("receipt_id"),
-        tags=txn.get("tags", []),
-        is_recurring=txn.get("is_recurring", False),
-        recurring_frequency=txn.get("recurring_frequency"),
-        recurring_interval=txn.get("recurring_interval", 1),
-        recurring_end_date=txn.get("recurring_end_date"),
-        created_at=txn["created_at"],
-        updated_at=txn["updated_at"]
-    )
+    return transaction_to_response(txn)
 
 
 @router.put("/{transaction_id}", response_model=TransactionResponse)
@@ -208,73 +581,54 @@ async def update_transaction(
     """Update a transaction"""
     transactions_collection = await get_collection("transactions")
     
+    # Get category name if category is changed
+    category_name = None
+    category = await get_category_cache().get(user_id, updates.category_id)
+    if category:
+        category_name = category["name"]
+    
     # Build update document
-    update_doc = {"updated_at": datetime.utcnow()}
-    if updates.type is not None:
-        update_doc["type"] = updates.type
-    if updates.amount is not None:
-        update_doc["amount"] = updates.amount
-    if updates.currency is not None:
-        update_doc["currency"] = updates.currency
-    if updates.category_id is not None:
-        update_doc["category_id"] = updates.category_id
-        # Update category name
-        categories_collection = await get_collection("categories")
-        category = await categories_collection.find_one({"_id": ObjectId(updates.category_id)})
-        if category:
-            update_doc["category_name"] = category["name"]
-    if updates.merchant_name is not None:
-        update_doc["merchant_name"] = updates.merchant_name
-    if updates.description is not None:
-        update_doc["description"] = updates.description
-    if updates.date is not None:
-        update_doc["date"] = updates.date
-    if updates.items is not None:
-        update_doc["items"] = [item.dict() for item in updates.items]
-    if updates.tags is not None:
-        update_doc["tags"] = updates.tags
-    if updates.is_recurring is not None:
-        update_doc["is_recurring"] = updates.is_recurring
-    if updates.recurring_frequency is not None:
-        update_doc["recurring_frequency"] = updates.recurring_frequency
-    if updates.recurring_interval is not None:
-        update_doc["recurring_interval"] = updates.recurring_interval
-    if updates.recurring_end_date is not None:
-        update_doc["recurring_end_date"] = updates.recurring_end_date
+    update_doc = _update_doc(updates, category_name)
+    query = {"_id": ObjectId(transaction_id), "user_id": user_id}
+    
+    # Re-index in the same write; matching on `updated_at` makes sure the
+    # terms were computed from the version being overwritten
+    if touches_search_fields(update_doc):
+        current = await transactions_collection.find_one(query, SEARCH_SOURCE_PROJECTION)
+        if not current:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Transaction not found"
+            )
+        update_doc["search_terms"] = search_terms({**current, **update_doc})
+        query["updated_at"] = current.get("updated_at")
     
-    # Update transaction
-    result = await transactions_collection.find_one_and_update(
-        {"_id": ObjectId(transaction_id), "user_id": user_id},
+    # Update transaction, keeping the old version for the category index
+    previous = await transactions_collection.find_one_and_update(
+        query,
         {"$set": update_doc},
-        return_document=True
+        projection=WITHOUT_SEARCH_TERMS,
+        return_document=ReturnDocument.BEFORE
     )
     
-    if not result:
+    if not previous:
+        if "updated_at" in query:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Transaction was modified concurrently, please retry"
+            )
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Transaction not found"
         )
+    result = {**previous, **update_doc}
     
-    return TransactionResponse(
-        id=str(result["_id"]),
-        type=result["type"],
-        amount=result["amount"],
-        currency=result.get("currency", "€"),
-        category_id=result.get("category_id"),
-        category_name=result.get("category_name"),
-        merchant_name=result.get("merchant_name"),
-        description=result.get("description"),
-        date=result["date"],
-        items=result.get("items", []),
-        receipt_id=result.get("receipt_id"),
-        tags=result.get("tags", []),
-        is_recurring=result.get("is_recurring", False),
-        recurring_frequency=result.get("recurring_frequency"),
-        recurring_interval=result.get("recurring_interval", 1),
-        recurring_end_date=result.get("recurring_end_date"),
-        created_at=result["created_at"],
-        updated_at=result["updated_at"]
-    )
+    index = get_category_index()
+    index.record(user_id, previous.get("merchant_name"), previous.get("category_id"), delta=-1)
+    index.record(user_id, result.get("merchant_name"), result.get("category_id"), result.get("category_name"))
+    await get_data_versions().bump(user_id)
+    
+    return transaction_to_response(result)
 
 
 @router.delete("/{transaction_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -285,36 +639,46 @@ async def delete_transaction(
     """Delete a transaction"""
     transactions_collection = await get_collection("transactions")
     
-    result = await transactions_collection.delete_one({
+    deleted = await transactions_collection.find_one_and_delete({
         "_id": ObjectId(transaction_id),
         "user_id": user_id
-    })
+    }, projection={"merchant_name": 1, "category_id": 1})
     
-    if result.deleted_count == 0:
+    if deleted is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Transaction not found"
         )
+    get_category_index().record(user_id, deleted.get("merchant_name"), deleted.get("category_id"), delta=-1)
+    await get_data_versions().bump(user_id)
 
 
 @router.get("/analytics/{period}", response_model=AnalyticsResponse)
 async def get_analytics(
     period: str,
+    request: Request,
+    response: Response,
     year: Optional[int] = Query(None, ge=2000, le=2100),
     month: Optional[int] = Query(None, ge=1, le=12),
     user_id: str = Depends(get_current_user_id)
 ):
     """
     Get analytics for a period (daily, monthly, yearly)
+    
+    Answers `If-None-Match` with 304 while the user's data is unchanged.
     """
     if period not in ["daily", "monthly", "yearly", "all"]:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Period must be 'daily', 'monthly', 'yearly', or 'all'"
         )
+    etag = await user_etag(user_id)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    set_etag(response, etag)
     
     transactions_collection = await get_collection("transactions")
-    categories_collection = await get_collection("categories")
     
     # Get date range
     start_date, end_date = get_period_dates(period, year, month)
@@ -336,7 +700,7 @@ async def get_analytics(
     # Get all transactions for user and filter in-app to support legacy string dates
     cursor = transactions_collection.find({
         "user_id": user_id
-    })
+    }, WITHOUT_SEARCH_TERMS)
     transactions = []
     async for txn in cursor:
         txn_date = parse_txn_date(txn.get("date"))
@@ -347,10 +711,7 @@ async def get_analytics(
             transactions.append(txn)
     
     # Get categories for mapping
-    categories_cursor = categories_collection.find({"user_id": user_id})
-    categories = {}
-    async for cat in categories_cursor:
-        categories[str(cat["_id"])] = cat
+    categories = await get_category_cache().get_all(user_id)
     
     # Calculate stats
     stats = await calculate_period_stats(transactions, start_date, end_date)
@@ -99,11 +99,70 @@ class TransactionResponse(BaseModel):
     updated_at: datetime
 
 
+class TransactionListItem(BaseModel):
+    """Transaction list row; only the requested `fields` are set"""
+    id: str
+    type: Optional[str] = None
+    amount: Optional[float] = None
+    currency: Optional[str] = None
+    category_id: Optional[str] = None
+    category_name: Optional[str] = None
+    merchant_name: Optional[str] = None
+    description: Optional[str] = None
+    date: Optional[datetime] = None
+    items: Optional[List[TransactionItem]] = None
+    item_count: Optional[int] = None
+    receipt_id: Optional[str] = None
+    tags: Optional[List[str]] = None
+    is_recurring: Optional[bool] = None
+    recurring_frequency: Optional[str] = None
+    recurring_interval: Optional[int] = None
+    recurring_end_date: Optional[datetime] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+
+class TransactionSearchResult(TransactionListItem):
+    """Transaction search hit"""
+    score: float
+
+
+class BulkTransactionOperation(BaseModel):
+    """One operation of a bulk transaction write"""
+    op: str = Field(..., pattern="^(create|update|delete)$")
+    id: Optional[str] = None  # Transaction to update or delete
+    data: Optional[dict] = None  # TransactionCreate for create, TransactionUpdate for update
+
+
+class BulkTransactionRequest(BaseModel):
+    """Bulk transaction write request"""
+    operations: List[BulkTransactionOperation] = Field(..., min_length=1, max_length=1000)
+
+
+class BulkOperationResult(BaseModel):
+    """Outcome of one bulk operation"""
+    index: int
+    op: str
+    status: str  # "created", "updated", "deleted", "not_found" or "error"
+    id: Optional[str] = None
+    error: Optional[str] = None
+
+
+class BulkTransactionResponse(BaseModel):
+    """Per-operation results of a bulk transaction write"""
+    results: List[BulkOperationResult]
+    created: int = 0
+    updated: int = 0
+    deleted: int = 0
+    failed: int = 0
+
+
 # Receipt Schemas
 class ReceiptScanResponse(BaseModel):
     """Receipt scan response"""
     id: str
     filename: str
+    original_filename: Optional[str] = None
     scan_status: str
     ai_confidence: Optional[float] = None
     extracted_data: Optional[dict] = None
@@ -120,6 +179,8 @@ class SettingsUpdate(BaseModel):
     theme: Optional[str] = Field(None, pattern="^(dark|light)$")
     budget_alerts: Optional[bool] = None
     monthly_budget: Optional[float] = Field(None, ge=0)
+    auto_create_transaction: Optional[bool] = None
+    auto_create_min_confidence: Optional[float] = Field(None, ge=0, le=1)
 
 
 class SettingsResponse(BaseModel):
@@ -128,6 +189,8 @@ class SettingsResponse(BaseModel):
     theme: str
     budget_alerts: bool
     monthly_budget: Optional[float]
+    auto_create_transaction: bool = False
+    auto_create_min_confidence: float = 0.8
     has_gemini_api_key: bool  # Don't expose the actual key
 
 
@@ -180,3 +243,21 @@ class AnalyticsResponse(BaseModel):
     stats: PeriodStats
     expense_breakdown: List[CategoryBreakdown]
     income_breakdown: List[CategoryBreakdown]
+
+
+class FacetBucket(BaseModel):
+    """Transaction count and totals for one tag, merchant or category"""
+    key: Optional[str]  # Tag, merchant name or category id (None: uncategorized)
+    label: Optional[str] = None  # Category name
+    count: int
+    expense: float
+    income: float
+
+
+class TransactionFacets(BaseModel):
+    """Top tags, merchants and categories of a date range"""
+    start_date: Optional[datetime]
+    end_date: Optional[datetime]
+    tags: List[FacetBucket]
+    merchants: List[FacetBucket]
+    categories: List[FacetBucket]
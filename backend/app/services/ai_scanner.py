@@ -1,15 +1,29 @@
 """
 Gemini 2.5 Flash Lite AI service for receipt scanning
 """
-import google.generativeai as genai
-from PIL import Image
 import json
-from typing import Optional, Dict, Any
+import time
+from typing import Optional, Dict, Any, Callable, Tuple
 import os
 import logging
 
+from .lru import LRUCache
+from .metrics import metrics
+from .image_preprocessing import PreparedImage
+from .scanner_backends import ScannerBackend, create_backend, backend_requires_api_key
+from .resilience import call_ai
+from .incremental_json import IncrementalObjectParser
+from .scan_stats import ScanStats
+
 logger = logging.getLogger(__name__)
 
+# Scanner pool configuration
+SCANNER_POOL_SIZE = int(os.getenv("SCANNER_POOL_SIZE", "32"))
+SCANNER_POOL_TTL = int(os.getenv("SCANNER_POOL_TTL", "1800"))
+
+# Stream model output and publish fields as they are parsed
+SCAN_STREAMING = os.getenv("SCAN_STREAMING", "false").lower() == "true"
+
 
 class GeminiReceiptScanner:
     """
@@ -23,73 +37,74 @@ class GeminiReceiptScanner:
     - Individual items with prices
     """
     
-    def __init__(self, api_key: Optional[str] = None):
-        """Initialize Gemini with API key"""
-        self.api_key = api_key or os.getenv("GEMINI_API_KEY")
-        if self.api_key:
-            genai.configure(api_key=self.api_key)
-            self.model = genai.GenerativeModel('gemini-2.5-flash-lite')
-        else:
-            self.model = None
-    
-    def set_api_key(self, api_key: str):
-        """Update API key dynamically"""
+    def __init__(self, api_key: Optional[str] = None, backend: Optional[ScannerBackend] = None):
+        """
+        Initialize the scanner with an API key or an explicit backend
+        
+        The backend (see `scanner_backends`) is chosen by SCANNER_BACKEND;
+        each Gemini backend owns its own client bound to `api_key`.
+        """
         self.api_key = api_key
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-2.5-flash-lite')
+        if backend is not None:
+            self.backend = backend
+        elif self.api_key or not backend_requires_api_key():
+            self.backend = create_backend(self.api_key)
+        else:
+            self.backend = None
     
-    async def scan_receipt(self, image_path: str) -> Dict[str, Any]:
+    async def scan_image(
+        self,
+        prepared: PreparedImage,
+        on_partial: Optional[Callable[[str, str, Any], None]] = None,
+        stats: Optional[ScanStats] = None
+    ) -> Dict[str, Any]:
         """
-        Scan receipt image and extract structured data
+        Extract structured data from an already preprocessed image
         
         Args:
-            image_path: Path to the receipt image
+            prepared: Output of `preprocess_image`
+            on_partial: Called with each parse event (see `incremental_json`)
+                while the response streams in; only used when SCAN_STREAMING
+                is enabled
+            stats: Receives model latency, parse time, token counts and
+                retries
             
         Returns:
             Dictionary with extracted data and confidence score
         """
-        if not self.model:
+        if not self.backend:
             raise ValueError("Gemini API key not configured. Please set it in settings.")
         
+        stats = stats or ScanStats()
+        
+        async def generate() -> str:
+            started = time.perf_counter()
+            if SCAN_STREAMING and on_partial is not None:
+                text = await self._stream_text(prepared, on_partial, stats)
+            else:
+                text = await self.backend.generate(RECEIPT_PROMPT, prepared, stats)
+            stats.model_ms = (time.perf_counter() - started) * 1000
+            return text
+        
+        def on_retry(error: Exception):
+            stats.retries += 1
+        
+        response_text = None
         try:
-            # Load image
-            img = Image.open(image_path)
-            
-            # Prompt for structured extraction
-            prompt = """
-Analyze this receipt image and extract the following information in JSON format:
-
-{
-  "merchant_name": "Store or restaurant name",
-  "date": "YYYY-MM-DD format",
-  "total_amount": 0.00,
-  "currency": "€ or $ or other symbol",
-  "items": [
-    {
-      "name": "Item name",
-      "quantity": 1.0,
-      "unit_price": 0.00,
-      "total_price": 0.00
-    }
-  ],
-  "tax_amount": 0.00,
-  "payment_method": "cash/card/other",
-  "confidence": 0.95
-}
-
-Important:
-- Return ONLY valid JSON, no markdown or extra text
-- If you cannot read something clearly, use null
-- Set confidence between 0.0 and 1.0 based on image quality
-- Extract ALL items from the receipt
-- Preserve original currency symbol
-"""
-            
-            # Generate response
-            response = self.model.generate_content([prompt, img])
+            call_started = time.perf_counter()
+            try:
+                if backend_requires_api_key():
+                    # Rate limited per key, retried on transient errors, circuit broken
+                    response_text = await call_ai(self.api_key, generate, on_retry=on_retry)
+                else:
+                    # Offline backends are not throttled, so benchmarks measure the pipeline
+                    response_text = await generate()
+            finally:
+                stats.ai_call_ms = (time.perf_counter() - call_started) * 1000
             
             # Parse JSON response
-            text = response.text.strip()
+            parse_started = time.perf_counter()
+            text = response_text.strip()
             
             # Remove markdown code blocks if present
             if text.startswith("```json"):
@@ -101,17 +116,20 @@ Important:
             text = text.strip()
             
             # Parse JSON
-            extracted_data = json.loads(text)
+            try:
+                extracted_data = json.loads(text)
+            finally:
+                stats.parse_ms = (time.perf_counter() - parse_started) * 1000
             
             logger.info(f"Successfully scanned receipt: {extracted_data.get('merchant_name')}")
             return extracted_data
             
         except json.JSONDecodeError as e:
             logger.error(f"Failed to parse Gemini response as JSON: {e}")
-            logger.error(f"Response text: {response.text}")
+            logger.error(f"Response text: {response_text}")
             return {
                 "error": "Failed to parse AI response",
-                "raw_response": response.text,
+                "raw_response": response_text,
                 "confidence": 0.0
             }
         except Exception as e:
@@ -121,11 +139,120 @@ Important:
                 "confidence": 0.0
             }
 
+    
+    async def _stream_text(
+        self,
+        prepared: PreparedImage,
+        on_partial: Callable[[str, str, Any], None],
+        stats: ScanStats
+    ) -> str:
+        """Stream the response, reporting fields as soon as they are complete"""
+        parser = IncrementalObjectParser()
+        chunks = []
+        async for chunk in self.backend.generate_stream(RECEIPT_PROMPT, prepared, stats):
+            chunks.append(chunk)
+            for kind, key, value in parser.feed(chunk):
+                on_partial(kind, key, value)
+        return "".join(chunks)
 
-# Global scanner instance (will be updated when user sets API key)
-scanner = GeminiReceiptScanner()
+
+# Prompt for structured extraction
+RECEIPT_PROMPT = """
+Analyze this receipt image and extract the following information in JSON format:
+
+{
+  "merchant_name": "Store or restaurant name",
+  "date": "YYYY-MM-DD format",
+  "total_amount": 0.00,
+  "currency": "€ or $ or other symbol",
+  "items": [
+    {
+      "name": "Item name",
+      "quantity": 1.0,
+      "unit_price": 0.00,
+      "total_price": 0.00
+    }
+  ],
+  "tax_amount": 0.00,
+  "payment_method": "cash/card/other",
+  "confidence": 0.95
+}
+
+Important:
+- Return ONLY valid JSON, no markdown or extra text
+- If you cannot read something clearly, use null
+- Set confidence between 0.0 and 1.0 based on image quality
+- Extract ALL items from the receipt
+- Preserve original currency symbol
+"""
+
+
+class ScannerPool:
+    """
+    LRU pool of scanners keyed by API key
+    
+    Scanners are reused across requests for the same key; entries idle for
+    longer than the TTL are dropped, and the least recently used entry is
+    evicted once the pool is full.
+    """
+    
+    def __init__(self, max_size: int = SCANNER_POOL_SIZE, idle_ttl: int = SCANNER_POOL_TTL):
+        self.idle_ttl = idle_ttl
+        self._entries: LRUCache[str, Tuple[GeminiReceiptScanner, float]] = LRUCache(max_size)
+    
+    def get(self, api_key: str) -> GeminiReceiptScanner:
+        """Return the pooled scanner for a key, creating it if needed"""
+        now = time.monotonic()
+        self._expire(now)
+        entry = self._entries.peek(api_key)
+        if entry:
+            scanner = entry[0]
+            metrics.incr("scanner_pool_hits")
+        else:
+            scanner = GeminiReceiptScanner(api_key)
+            metrics.incr("scanner_pool_misses")
+        evicted = self._entries.put(api_key, (scanner, now))
+        if evicted:
+            metrics.incr("scanner_pool_evictions", evicted)
+        metrics.set_gauge("scanner_pool_size", len(self._entries))
+        return scanner
+    
+    def invalidate(self, api_key: Optional[str]):
+        """Drop the scanner for a key (e.g. after a user replaced it)"""
+        if api_key and self._entries.pop(api_key):
+            metrics.set_gauge("scanner_pool_size", len(self._entries))
+    
+    def _expire(self, now: float):
+        while True:
+            oldest = self._entries.oldest()
+            if oldest is None:
+                break
+            api_key, (_, last_used) = oldest
+            if now - last_used <= self.idle_ttl:
+                break
+            self._entries.pop(api_key)
+            metrics.incr("scanner_pool_expired")
+
+
+# Global scanner pool (keys come from user settings or GEMINI_API_KEY)
+scanner_pool = ScannerPool()
+
+
+def get_scanner(api_key: Optional[str] = None) -> Optional[GeminiReceiptScanner]:
+    """
+    Get the pooled scanner for a user's API key
+    
+    Falls back to the GEMINI_API_KEY environment variable; returns None
+    when no key is available and the backend needs one.
+    """
+    api_key = api_key or os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        if backend_requires_api_key():
+            return None
+        api_key = ""
+    return scanner_pool.get(api_key)
 
 
-def get_scanner() -> GeminiReceiptScanner:
-    """Get the global scanner instance"""
-    return scanner
+def get_scanner_pool() -> ScannerPool:
+    """Get the global scanner pool"""
+    return scanner_pool
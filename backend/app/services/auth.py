@@ -16,6 +16,9 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "change-this-to-a-secure-random-key-in-production")
 ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+# Tickets that open the receipt event stream (passed in the URL)
+SSE_TICKET_EXPIRE_SECONDS = int(os.getenv("SSE_TICKET_EXPIRE_SECONDS", "60"))
+SSE_TICKET_SCOPE = "sse"
 
 security = HTTPBearer()
 
@@ -52,6 +55,20 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return encoded_jwt
 
 
+def create_sse_ticket(user_id: str) -> str:
+    """
+    Create a short-lived ticket for the receipt event stream
+
+    EventSource cannot send headers, so the ticket travels in the query
+    string, where it may end up in access logs. It is only accepted by the
+    event stream and expires after SSE_TICKET_EXPIRE_SECONDS.
+    """
+    return create_access_token(
+        {"sub": user_id, "scope": SSE_TICKET_SCOPE},
+        expires_delta=timedelta(seconds=SSE_TICKET_EXPIRE_SECONDS)
+    )
+
+
 async def get_current_user_id(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
     """
     Dependency to get current authenticated user ID from JWT
@@ -62,6 +79,23 @@ async def get_current_user_id(credentials: HTTPAuthorizationCredentials = Depend
     Returns:
         User ID string
         
+    Raises:
+        HTTPException: If token is invalid or expired
+    """
+    return decode_user_id(credentials.credentials)
+
+
+def decode_user_id(token: str, scope: Optional[str] = None) -> str:
+    """
+    Get the user ID from a JWT access token
+    
+    Args:
+        token: Encoded JWT
+        scope: Required scope; None accepts only full access tokens
+        
+    Returns:
+        User ID string
+        
     Raises:
         HTTPException: If token is invalid or expired
     """
@@ -72,10 +106,9 @@ async def get_current_user_id(credentials: HTTPAuthorizationCredentials = Depend
     )
     
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
-        if user_id is None:
+        if user_id is None or payload.get("scope") != scope:
             raise credentials_exception
         return user_id
     except JWTError:
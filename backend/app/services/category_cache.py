@@ -0,0 +1,127 @@
+"""
+Per-user cache of category documents
+
+Transaction writes denormalize `category_name`, and category lists and
+analytics need every category of a user. The cache keeps each user's
+categories in memory for CATEGORY_CACHE_TTL seconds; the category handlers
+invalidate it on every change, and the TTL bounds how stale another process
+can be. Renames also rewrite `category_name` on the user's transactions in
+the background.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+from .database import get_collection
+from .data_versions import get_data_versions
+from .lru import LRUCache, SharedLoader
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CATEGORY_CACHE_TTL = float(os.getenv("CATEGORY_CACHE_TTL", "300"))
+CATEGORY_CACHE_MAX_USERS = int(os.getenv("CATEGORY_CACHE_MAX_USERS", "1000"))
+# Transactions rewritten per update when a category is renamed
+CATEGORY_RENAME_BATCH_SIZE = int(os.getenv("CATEGORY_RENAME_BATCH_SIZE", "500"))
+
+
+class CategoryCache:
+    """LRU of per-user category documents keyed by category id, with a TTL"""
+
+    def __init__(self, ttl: float = CATEGORY_CACHE_TTL, max_users: int = CATEGORY_CACHE_MAX_USERS):
+        self.ttl = ttl
+        self._entries: LRUCache[str, Tuple[float, Dict[str, dict]]] = LRUCache(max_users)
+        self._loader: SharedLoader[str, Dict[str, dict]] = SharedLoader()
+        self._renames: Dict[Tuple[str, str], asyncio.Task] = {}
+
+    async def get_all(self, user_id: str) -> Dict[str, dict]:
+        """
+        All categories of a user by id
+
+        The documents are shared with other callers and must not be modified.
+        """
+        entry = self._entries.get(user_id)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            metrics.incr("category_cache_hits")
+            return entry[1]
+        metrics.incr("category_cache_misses")
+
+        # Concurrent misses share one query
+        return await self._loader.load(
+            user_id,
+            lambda: self._load(user_id),
+            lambda categories: self._store(user_id, categories)
+        )
+
+    async def get(self, user_id: str, category_id: Optional[str]) -> Optional[dict]:
+        """One of the user's categories, or None"""
+        if not category_id:
+            return None
+        return (await self.get_all(user_id)).get(category_id)
+
+    async def names(self, user_id: str, category_ids: Iterable[str]) -> Dict[str, str]:
+        """Names of the given categories of the user (unknown ids are left out)"""
+        categories = await self.get_all(user_id)
+        return {cid: categories[cid]["name"] for cid in set(category_ids) if cid in categories}
+
+    def invalidate(self, user_id: str):
+        """Forget a user's categories after they changed"""
+        self._entries.pop(user_id)
+        self._loader.forget(user_id)
+
+    def rename(self, user_id: str, category_id: str, name: str):
+        """
+        Rewrite `category_name` on the user's transactions in the background
+
+        A newer rename of the same category cancels the running one, so the
+        last name always wins.
+        """
+        key = (user_id, category_id)
+        previous = self._renames.get(key)
+        if previous is not None:
+            previous.cancel()
+        task = self._renames[key] = asyncio.create_task(self._rewrite_names(user_id, category_id, name))
+        task.add_done_callback(lambda done: self._renames.pop(key, None) if self._renames.get(key) is done else None)
+
+    async def _rewrite_names(self, user_id: str, category_id: str, name: str):
+        """Set the new name on the category's transactions in batches"""
+        transactions_collection = await get_collection("transactions")
+        query = {"user_id": user_id, "category_id": category_id, "category_name": {"$ne": name}}
+        updated = 0
+        try:
+            while True:
+                batch = await transactions_collection.find(query, {"_id": 1}) \
+                    .limit(CATEGORY_RENAME_BATCH_SIZE) \
+                    .to_list(length=CATEGORY_RENAME_BATCH_SIZE)
+                if not batch:
+                    break
+                result = await transactions_collection.update_many(
+                    {"_id": {"$in": [txn["_id"] for txn in batch]}, "category_id": category_id},
+                    {"$set": {"category_name": name}}
+                )
+                updated += result.modified_count
+        except Exception as e:
+            logger.error(f"Renaming category {category_id} on transactions of user {user_id} failed: {e}")
+            return
+        metrics.incr("category_rename_transactions", updated)
+        if updated:
+            await get_data_versions().bump(user_id)
+
+    async def _load(self, user_id: str) -> Dict[str, dict]:
+        categories_collection = await get_collection("categories")
+        cursor = categories_collection.find({"user_id": user_id})
+        return {str(cat["_id"]): cat async for cat in cursor}
+
+    def _store(self, user_id: str, categories: Dict[str, dict]):
+        self._entries.put(user_id, (time.monotonic(), categories))
+        metrics.set_gauge("category_cache_users", len(self._entries))
+
+
+category_cache = CategoryCache()
+
+
+def get_category_cache() -> CategoryCache:
+    """Get the global category cache"""
+    return category_cache
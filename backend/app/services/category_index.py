@@ -0,0 +1,222 @@
+"""
+Per-user merchant to category prediction index
+
+Users tend to file the same merchant under the same category. The index
+keeps, per user, how often each normalized merchant name was booked to each
+category, so scanned receipts can be pre-categorized without another AI call.
+It is seeded lazily from the `transactions` collection on a user's first
+lookup and kept current by the transactions router.
+"""
+import logging
+import os
+import re
+from dataclasses import dataclass
+from typing import Container, Dict, Optional
+
+from .database import get_collection
+from .category_cache import get_category_cache
+from .lru import LRUCache, SharedLoader
+from .metrics import metrics
+from .search import fold_text
+
+logger = logging.getLogger(__name__)
+
+# Memory bounds: users kept in memory and merchants remembered per user
+CATEGORY_INDEX_MAX_USERS = int(os.getenv("CATEGORY_INDEX_MAX_USERS", "1000"))
+CATEGORY_INDEX_MAX_MERCHANTS = int(os.getenv("CATEGORY_INDEX_MAX_MERCHANTS", "2000"))
+# Minimum share of a merchant's transactions a category needs to be predicted
+CATEGORY_PREDICT_MIN_SHARE = float(os.getenv("CATEGORY_PREDICT_MIN_SHARE", "0.5"))
+
+_NON_WORD = re.compile(r"[^\w]+")
+# Trailing branch numbers such as "Lidl 1234" or "Shell #12"
+_BRANCH_SUFFIX = re.compile(r"(\s+(no|nr)?\s*\d+)+$")
+
+
+def normalize_merchant(name: Optional[str]) -> str:
+    """Reduce a merchant name to a lookup key ("REWE Markt #123" -> "rewe markt")"""
+    if not name:
+        return ""
+    text = _NON_WORD.sub(" ", fold_text(name)).strip()
+    return _BRANCH_SUFFIX.sub("", text)
+
+
+@dataclass
+class CategoryPrediction:
+    """Most likely category for a merchant"""
+    category_id: str
+    category_name: Optional[str]
+    confidence: float  # Share of the merchant's transactions in this category
+
+
+class _UserIndex:
+    """Category counts per merchant for one user, bounded in size"""
+
+    def __init__(self, max_merchants: int):
+        # Forgets the merchants booked least recently
+        self.merchants: LRUCache[str, Dict[str, int]] = LRUCache(max_merchants)
+        self.names: Dict[str, str] = {}
+
+    def add(self, merchant: str, category_id: str, category_name: Optional[str], delta: int = 1):
+        counts = self.merchants.get(merchant)
+        if counts is None:
+            if delta <= 0:
+                return
+            counts = {}
+            self.merchants.put(merchant, counts)
+        count = counts.get(category_id, 0) + delta
+        if count > 0:
+            counts[category_id] = count
+        else:
+            counts.pop(category_id, None)
+            if not counts:
+                self.merchants.pop(merchant)
+        if category_name:
+            self.names[category_id] = category_name
+
+    def predict(self, merchant: str, categories: Container[str]) -> Optional[CategoryPrediction]:
+        """Most booked of the merchant's categories that still exist in `categories`"""
+        counts = self.merchants.peek(merchant)
+        if not counts:
+            return None
+        existing = [(category_id, count) for category_id, count in counts.items() if category_id in categories]
+        if not existing:
+            return None
+        category_id, count = max(existing, key=lambda pair: pair[1])
+        # Bookings to deleted categories still count against the share
+        share = count / sum(counts.values())
+        if share < CATEGORY_PREDICT_MIN_SHARE:
+            return None
+        return CategoryPrediction(category_id, self.names.get(category_id), round(share, 3))
+
+
+class CategoryIndex:
+    """LRU of per-user merchant indexes"""
+
+    def __init__(self, max_users: int = CATEGORY_INDEX_MAX_USERS, max_merchants: int = CATEGORY_INDEX_MAX_MERCHANTS):
+        self.max_merchants = max_merchants
+        self._users: LRUCache[str, _UserIndex] = LRUCache(max_users)
+        self._loader: SharedLoader[str, _UserIndex] = SharedLoader()
+
+    async def predict(self, user_id: str, merchant_name: Optional[str]) -> Optional[CategoryPrediction]:
+        """Predict the category of a merchant from the user's history"""
+        merchant = normalize_merchant(merchant_name)
+        if not merchant:
+            return None
+        index = await self._get(user_id)
+        # Transactions keep the ids of deleted categories and their old names
+        categories = await get_category_cache().get_all(user_id)
+        prediction = index.predict(merchant, categories)
+        if prediction is not None:
+            prediction.category_name = categories[prediction.category_id]["name"]
+        metrics.incr("category_predictions" if prediction else "category_prediction_misses")
+        return prediction
+
+    def record(
+        self,
+        user_id: str,
+        merchant_name: Optional[str],
+        category_id: Optional[str],
+        category_name: Optional[str] = None,
+        delta: int = 1
+    ):
+        """
+        Count a transaction booked (delta=1) or un-booked (delta=-1)
+
+        Users that are not loaded are skipped; their next lookup reads the
+        change from MongoDB.
+        """
+        index = self._users.peek(user_id)
+        merchant = normalize_merchant(merchant_name)
+        if index is None or not merchant or not category_id:
+            return
+        index.add(merchant, category_id, category_name, delta)
+
+    def invalidate(self, user_id: str):
+        """Drop a user's index, e.g. after bulk changes to their data"""
+        self._users.pop(user_id)
+        self._loader.forget(user_id)
+        metrics.set_gauge("category_index_users", len(self._users))
+
+    async def _get(self, user_id: str) -> _UserIndex:
+        index = self._users.get(user_id)
+        if index is not None:
+            return index
+        # Concurrent first lookups share one seeding query
+        return await self._loader.load(
+            user_id,
+            lambda: self._load(user_id),
+            lambda index: self._store(user_id, index)
+        )
+
+    async def _load(self, user_id: str) -> _UserIndex:
+        """Seed a user's index from their categorized transactions"""
+        transactions_collection = await get_collection("transactions")
+        cursor = transactions_collection.aggregate([
+            {"$match": {
+                "user_id": user_id,
+                "merchant_name": {"$nin": [None, ""]},
+                "category_id": {"$nin": [None, ""]}
+            }},
+            {"$group": {
+                "_id": {"merchant": "$merchant_name", "category": "$category_id"},
+                "count": {"$sum": 1},
+                "category_name": {"$last": "$category_name"},
+                "last_date": {"$max": "$date"}
+            }},
+            {"$sort": {"last_date": -1}},
+            {"$limit": self.max_merchants * 4}
+        ])
+        groups = await cursor.to_list(length=None)
+
+        index = _UserIndex(self.max_merchants)
+        # Oldest first, so the most recently used merchants survive the bound
+        for group in reversed(groups):
+            merchant = normalize_merchant(group["_id"]["merchant"])
+            if not merchant:
+                continue
+            index.add(
+                merchant,
+                str(group["_id"]["category"]),
+                group.get("category_name"),
+                group["count"]
+            )
+        metrics.incr("category_index_loads")
+        return index
+
+    def _store(self, user_id: str, index: _UserIndex):
+        self._users.put(user_id, index)
+        metrics.set_gauge("category_index_users", len(self._users))
+
+
+async def attach_predicted_category(user_id: str, extracted_data: dict) -> dict:
+    """
+    Add the predicted category to scan results
+
+    Returns a copy of `extracted_data` with `category_id`, `category_name`
+    and `category_confidence` set, or `extracted_data` unchanged when there
+    is no confident prediction.
+    """
+    if extracted_data.get("category_id"):
+        return extracted_data
+    try:
+        prediction = await category_index.predict(user_id, extracted_data.get("merchant_name"))
+    except Exception as e:
+        # A prediction is a convenience - never fail the scan over it
+        logger.warning(f"Category prediction failed for user {user_id}: {e}")
+        return extracted_data
+    if prediction is None:
+        return extracted_data
+    return {
+        **extracted_data,
+        "category_id": prediction.category_id,
+        "category_name": prediction.category_name,
+        "category_confidence": prediction.confidence
+    }
+
+
+category_index = CategoryIndex()
+
+
+def get_category_index() -> CategoryIndex:
+    """Get the global category index"""
+    return category_index
@@ -0,0 +1,161 @@
+"""
+Per-user data versions for conditional GETs
+
+Every write to a user's transactions or categories bumps a counter in the
+`data_versions` collection. Read endpoints derive an ETag from it and answer
+a matching `If-None-Match` with `304 Not Modified` before running any query.
+Versions are cached in process for DATA_VERSION_TTL seconds, which bounds
+how long another worker process can serve a stale version.
+
+Reads hide transactions dated in the future, so such a row appearing is a
+change too: the version document keeps the earliest future `date` of the
+user's transactions (`upcoming`), and the first read after it has passed
+bumps the version and moves `upcoming` to the next future date.
+"""
+import hashlib
+import os
+import time
+from datetime import datetime
+from typing import Optional, Tuple
+
+from fastapi import Request, Response, status
+from pymongo import ASCENDING, ReturnDocument
+
+from .database import get_collection
+from .lru import LRUCache
+from .metrics import metrics
+
+DATA_VERSION_TTL = float(os.getenv("DATA_VERSION_TTL", "30"))
+DATA_VERSION_MAX_USERS = int(os.getenv("DATA_VERSION_MAX_USERS", "10000"))
+# Concurrent writers can make advancing past `upcoming` miss; bounded retries
+DATA_VERSION_ADVANCE_ATTEMPTS = 3
+
+
+def _passed(upcoming: Optional[datetime], now: datetime) -> bool:
+    return upcoming is not None and upcoming <= now
+
+
+async def _next_upcoming(user_id: str, now: datetime) -> Optional[datetime]:
+    """Earliest date of the user's transactions still in the future, if any"""
+    transactions_collection = await get_collection("transactions")
+    txn = await transactions_collection.find_one(
+        {"user_id": user_id, "date": {"$gt": now}},
+        {"date": 1},
+        sort=[("date", ASCENDING)]
+    )
+    return txn["date"] if txn else None
+
+
+class DataVersions:
+    """Cached per-user change counters"""
+
+    def __init__(self, ttl: float = DATA_VERSION_TTL, max_users: int = DATA_VERSION_MAX_USERS):
+        self.ttl = ttl
+        self._versions: LRUCache[str, Tuple[float, int, Optional[datetime]]] = LRUCache(max_users)
+
+    async def get(self, user_id: str) -> int:
+        """Current data version of a user (0 before their first write)"""
+        entry = self._versions.get(user_id)
+        now = datetime.utcnow()
+        if entry is not None and time.monotonic() - entry[0] < self.ttl and not _passed(entry[2], now):
+            return entry[1]
+        versions_collection = await get_collection("data_versions")
+        doc = await versions_collection.find_one({"_id": user_id})
+        for _ in range(DATA_VERSION_ADVANCE_ATTEMPTS):
+            if doc is None or not _passed(doc.get("upcoming"), now):
+                break
+            doc = await self._advance(user_id, doc, now)
+        version = doc["version"] if doc else 0
+        self._remember(user_id, version, doc.get("upcoming") if doc else None)
+        return version
+
+    async def bump(self, user_id: str) -> int:
+        """Record a change to a user's data; call after the write succeeded"""
+        versions_collection = await get_collection("data_versions")
+        update = {"$inc": {"version": 1}}
+        upcoming = await _next_upcoming(user_id, datetime.utcnow())
+        if upcoming is not None:
+            # Never later than a future row another write already recorded
+            update["$min"] = {"upcoming": upcoming}
+        doc = await versions_collection.find_one_and_update(
+            {"_id": user_id},
+            update,
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        entry = self._versions.peek(user_id)
+        # Concurrent bumps may return out of order - never go backwards
+        version = max(doc["version"], entry[1]) if entry else doc["version"]
+        self._remember(user_id, version, doc.get("upcoming"))
+        metrics.incr("data_version_bumps")
+        return version
+
+    async def _advance(self, user_id: str, doc: dict, now: datetime) -> Optional[dict]:
+        """
+        Bump the version once `upcoming` has passed and record the next one
+
+        Matching on the version makes a concurrent bump win; the caller then
+        retries with the re-read document.
+        """
+        versions_collection = await get_collection("data_versions")
+        upcoming = await _next_upcoming(user_id, now)
+        update = {"$inc": {"version": 1}}
+        if upcoming is None:
+            update["$unset"] = {"upcoming": ""}
+        else:
+            update["$set"] = {"upcoming": upcoming}
+        advanced = await versions_collection.find_one_and_update(
+            {"_id": user_id, "version": doc["version"], "upcoming": doc["upcoming"]},
+            update,
+            return_document=ReturnDocument.AFTER
+        )
+        if advanced is None:
+            return await versions_collection.find_one({"_id": user_id})
+        metrics.incr("data_version_upcoming_passed")
+        return advanced
+
+    def _remember(self, user_id: str, version: int, upcoming: Optional[datetime] = None):
+        self._versions.put(user_id, (time.monotonic(), version, upcoming))
+
+
+data_versions = DataVersions()
+
+
+def get_data_versions() -> DataVersions:
+    """Get the global data version cache"""
+    return data_versions
+
+
+async def user_etag(user_id: str) -> str:
+    """
+    ETag for a user's current data
+
+    Includes a hash of the user id, so a browser shared by two accounts never
+    matches the other's tag, and the UTC date, because analytics periods
+    depend on today. Future-dated transactions becoming visible bump the
+    version (see `DataVersions.get`).
+    """
+    version = await data_versions.get(user_id)
+    owner = hashlib.sha1(user_id.encode()).hexdigest()[:12]
+    return f'W/"{owner}-{version}-{datetime.utcnow():%Y%m%d}"'
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """A 304 response if the request's `If-None-Match` matches `etag`"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return None
+    tags = {tag.strip() for tag in header.split(",")}
+    # Weak comparison: W/"x" and "x" are the same tag
+    if "*" in tags or etag in tags or etag[2:] in tags:
+        metrics.incr("not_modified_responses")
+        response = Response(status_code=status.HTTP_304_NOT_MODIFIED)
+        set_etag(response, etag)
+        return response
+    return None
+
+
+def set_etag(response: Response, etag: str):
+    """Tag a response and make clients revalidate it before reuse"""
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
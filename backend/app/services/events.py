@@ -0,0 +1,81 @@
+"""
+In-process pub/sub hub for per-user events
+
+The scan pipeline publishes receipt status changes here and the SSE endpoint
+relays them to connected clients. Subscribers only see events published by
+the same process.
+"""
+import asyncio
+from collections import defaultdict
+from typing import Dict, Set
+
+from .metrics import metrics
+
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class EventHub:
+    """Fan-out of events to the open subscriptions of each user"""
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        """Open a subscription; events for the user are put on the returned queue"""
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers[user_id].add(queue)
+        metrics.incr("event_subscribers")
+        return queue
+
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue):
+        """Close a subscription"""
+        queues = self._subscribers.get(user_id)
+        if queues and queue in queues:
+            queues.discard(queue)
+            metrics.incr("event_subscribers", -1)
+            if not queues:
+                del self._subscribers[user_id]
+
+    def publish(self, user_id: str, event: str, data: dict):
+        """Deliver an event to every subscription of a user without blocking"""
+        for queue in self._subscribers.get(user_id, ()):
+            try:
+                queue.put_nowait((event, data))
+            except asyncio.QueueFull:
+                # Slow client - drop rather than stall the publisher
+                metrics.incr("events_dropped")
+
+
+event_hub = EventHub()
+
+
+def get_event_hub() -> EventHub:
+    """Get the global event hub"""
+    return event_hub
+
+
+def publish_scan_status(receipt: dict):
+    """Publish the current `scan_status` of a receipt document"""
+    event_hub.publish(receipt["user_id"], "scan_status", {
+        "id": str(receipt["_id"]),
+        "scan_status": receipt["scan_status"],
+        "ai_confidence": receipt.get("ai_confidence"),
+        "extracted_data": receipt.get("extracted_data"),
+        "error_message": receipt.get("error_message"),
+        "transaction_id": receipt.get("transaction_id")
+    })
+
+
+def publish_scan_partial(receipt: dict, kind: str, field: str, value):
+    """
+    Publish a partially parsed scan result
+
+    `kind` is "field" for a completed top-level field or "item" for one
+    element of the streamed `items` array.
+    """
+    event_hub.publish(receipt["user_id"], "scan_partial", {
+        "id": str(receipt["_id"]),
+        "kind": kind,
+        "field": field,
+        "value": value
+    })
@@ -0,0 +1,137 @@
+"""
+Tag, merchant and category facets of a user's transactions
+
+One `$facet` aggregation over the (user_id, date) index groups a date range
+by tag, merchant and category and keeps the top buckets of each. Results are
+cached per query and tagged with the user's data version, so any write to
+the user's data makes the cached facets miss. Ranges stop at now, like the
+transaction list and analytics; the data version also changes when a
+future-dated transaction comes due, so cached ranges need no expiry of
+their own.
+"""
+import os
+from datetime import datetime
+from typing import Optional, Tuple
+
+from .database import get_collection
+from .category_cache import get_category_cache
+from .data_versions import get_data_versions
+from .lru import LRUCache
+from .metrics import metrics
+
+FACET_CACHE_SIZE = int(os.getenv("FACET_CACHE_SIZE", "1024"))
+
+
+def _group_stage(key) -> dict:
+    return {
+        "$group": {
+            "_id": key,
+            "label": {"$last": "$category_name"},
+            "count": {"$sum": 1},
+            "expense": {"$sum": {"$cond": [{"$eq": ["$type", "expense"]}, "$amount", 0]}},
+            "income": {"$sum": {"$cond": [{"$eq": ["$type", "income"]}, "$amount", 0]}}
+        }
+    }
+
+
+def _top(key, limit: int, prefix: Optional[list] = None) -> list:
+    """Pipeline of one facet: group by `key`, most transactions first"""
+    return (prefix or []) + [
+        _group_stage(key),
+        {"$sort": {"count": -1, "expense": -1, "_id": 1}},
+        {"$limit": limit}
+    ]
+
+
+def _bucket(group: dict, labelled: bool) -> dict:
+    return {
+        "key": str(group["_id"]) if group["_id"] is not None else None,
+        "label": group.get("label") if labelled else None,
+        "count": group["count"],
+        "expense": round(group["expense"], 2),
+        "income": round(group["income"], 2)
+    }
+
+
+class FacetCache:
+    """LRU of facet results, valid while the user's data version is unchanged"""
+
+    def __init__(self, max_size: int = FACET_CACHE_SIZE):
+        self._entries: LRUCache[Tuple, Tuple[int, dict]] = LRUCache(max_size)
+
+    def get(self, key: Tuple, version: int) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != version:
+            metrics.incr("facet_cache_misses")
+            return None
+        metrics.incr("facet_cache_hits")
+        return entry[1]
+
+    def put(self, key: Tuple, version: int, facets: dict):
+        self._entries.put(key, (version, facets))
+
+
+facet_cache = FacetCache()
+
+
+async def transaction_facets(
+    user_id: str,
+    start_date: Optional[datetime],
+    end_date: Optional[datetime],
+    transaction_type: Optional[str] = None,
+    limit: int = 10
+) -> dict:
+    """
+    Top tags, merchants and categories of a user's transactions in a date range
+
+    Args:
+        user_id: Owner of the transactions
+        start_date: Inclusive start, or None for all history
+        end_date: Inclusive end, capped at now; None for up to now
+        transaction_type: Only "expense" or "income" transactions, if set
+        limit: Buckets returned per facet
+
+    Returns:
+        Dict with `tags`, `merchants` and `categories` lists of buckets
+        (`key`, `label`, `count`, `expense`, `income`)
+    """
+    version = await get_data_versions().get(user_id)
+    key = (user_id, start_date, end_date, transaction_type, limit)
+    cached = facet_cache.get(key, version)
+    if cached is not None:
+        return cached
+
+    now = datetime.utcnow()
+    date_query = {"$lte": min(end_date, now) if end_date else now}
+    if start_date:
+        date_query["$gte"] = start_date
+    match = {"user_id": user_id, "date": date_query}
+    if transaction_type:
+        match["type"] = transaction_type
+
+    transactions_collection = await get_collection("transactions")
+    cursor = transactions_collection.aggregate([
+        {"$match": match},
+        {"$project": {
+            "type": 1, "amount": 1, "tags": 1,
+            "merchant_name": 1, "category_id": 1, "category_name": 1
+        }},
+        {"$facet": {
+            "tags": _top("$tags", limit, [{"$unwind": "$tags"}]),
+            "merchants": _top("$merchant_name", limit, [{"$match": {"merchant_name": {"$nin": [None, ""]}}}]),
+            "categories": _top("$category_id", limit)
+        }}
+    ])
+    result = (await cursor.to_list(length=1))[0]
+
+    facets = {
+        "tags": [_bucket(group, False) for group in result["tags"]],
+        "merchants": [_bucket(group, False) for group in result["merchants"]],
+        "categories": [_bucket(group, True) for group in result["categories"]]
+    }
+    # Prefer current category names over the denormalized ones
+    names = await get_category_cache().names(user_id, [bucket["key"] for bucket in facets["categories"]])
+    for bucket in facets["categories"]:
+        bucket["label"] = names.get(bucket["key"], bucket["label"])
+    facet_cache.put(key, version, facets)
+    return facets
@@ -0,0 +1,75 @@
+"""
+Image preprocessing applied to receipts before AI submission
+
+Phone photos are far larger than the model needs; shrinking them first makes
+requests smaller and model latency lower.
+"""
+import hashlib
+import io
+import os
+from dataclasses import dataclass
+
+from PIL import Image, ImageChops, ImageOps
+
+from .metrics import metrics
+
+# Preprocessing configuration
+PREPROCESS_ENABLED = os.getenv("PREPROCESS_ENABLED", "true").lower() == "true"
+PREPROCESS_MAX_EDGE = int(os.getenv("PREPROCESS_MAX_EDGE", "1600"))
+PREPROCESS_GRAYSCALE = os.getenv("PREPROCESS_GRAYSCALE", "true").lower() == "true"
+PREPROCESS_AUTOCROP = os.getenv("PREPROCESS_AUTOCROP", "false").lower() == "true"
+PREPROCESS_JPEG_QUALITY = int(os.getenv("PREPROCESS_JPEG_QUALITY", "80"))
+
+
+@dataclass
+class PreparedImage:
+    """Image bytes ready for the model, with before/after sizes"""
+    data: bytes
+    content_hash: str
+    original_bytes: int
+    processed_bytes: int
+    width: int
+    height: int
+
+
+def _autocrop(img: Image.Image) -> Image.Image:
+    """Crop away a uniform border matching the top-left pixel colour"""
+    background = Image.new(img.mode, img.size, img.getpixel((0, 0)))
+    diff = ImageChops.difference(img, background).convert("L").point(lambda v: 255 if v > 24 else 0)
+    bbox = diff.getbbox()
+    return img.crop(bbox) if bbox else img
+
+
+def preprocess_image(image_path: str) -> PreparedImage:
+    """
+    Load and shrink a receipt image (blocking, run in a worker thread)
+
+    Applies EXIF rotation, optional border crop, downscaling to the maximum
+    edge length and grayscale conversion, then re-encodes as JPEG. When
+    preprocessing is disabled the original bytes are returned unchanged.
+    """
+    with open(image_path, "rb") as f:
+        original = f.read()
+    digest = hashlib.sha256(original).hexdigest()
+
+    if not PREPROCESS_ENABLED:
+        with Image.open(io.BytesIO(original)) as img:
+            width, height = img.size
+        return PreparedImage(original, digest, len(original), len(original), width, height)
+
+    with Image.open(io.BytesIO(original)) as img:
+        img = ImageOps.exif_transpose(img)
+        img = img.convert("L" if PREPROCESS_GRAYSCALE else "RGB")
+        if PREPROCESS_AUTOCROP:
+            img = _autocrop(img)
+        if PREPROCESS_MAX_EDGE > 0:
+            img.thumbnail((PREPROCESS_MAX_EDGE, PREPROCESS_MAX_EDGE), Image.LANCZOS)
+
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=PREPROCESS_JPEG_QUALITY, optimize=True)
+        data = buffer.getvalue()
+        width, height = img.size
+
+    metrics.incr("preprocess_bytes_in", len(original))
+    metrics.incr("preprocess_bytes_out", len(data))
+    return PreparedImage(data, digest, len(original), len(data), width, height)
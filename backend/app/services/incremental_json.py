@@ -0,0 +1,126 @@
+"""
+Incremental parser for the streamed receipt JSON
+
+The model streams a single JSON object, optionally wrapped in a markdown
+fence. The parser is fed chunks as they arrive and reports each top-level
+field as soon as its value is complete; elements of streamed arrays (such as
+`items`) are reported one by one.
+"""
+import json
+from typing import Any, Iterable, List, Optional, Tuple
+
+_WHITESPACE = " \t\r\n"
+_DELIMITERS = _WHITESPACE + ",:}]"
+
+# ("field", key, value) for completed top-level fields,
+# ("item", key, value) for each completed element of a streamed array
+ParseEvent = Tuple[str, str, Any]
+
+
+class IncrementalObjectParser:
+    """Streaming parser for one top-level JSON object"""
+
+    def __init__(self, streamed_arrays: Iterable[str] = ("items",)):
+        self.streamed_arrays = set(streamed_arrays)
+        self.buffer = ""
+        self.pos: Optional[int] = None
+        self.done = False
+        self._key: Optional[str] = None
+        self._in_array = False
+        self._array: List[Any] = []
+        self._decoder = json.JSONDecoder()
+
+    def feed(self, chunk: str) -> List[ParseEvent]:
+        """Add streamed text and return the events it completed"""
+        self.buffer += chunk
+        events: List[ParseEvent] = []
+        if self.done:
+            return events
+        if self.pos is None:
+            start = self.buffer.find("{")
+            if start == -1:
+                return events
+            self.pos = start + 1
+
+        while not self.done:
+            if self._in_array:
+                if not self._step_array(events):
+                    break
+            elif not self._step_object(events):
+                break
+        return events
+
+    def _skip(self, chars: str = _WHITESPACE):
+        while self.pos < len(self.buffer) and self.buffer[self.pos] in chars:
+            self.pos += 1
+
+    def _decode(self) -> Tuple[bool, Any]:
+        """
+        Decode the value at the current position
+
+        A value is only accepted once a delimiter follows it, so numbers and
+        literals cut off mid-stream are never reported early.
+        """
+        try:
+            value, end = self._decoder.raw_decode(self.buffer, self.pos)
+        except json.JSONDecodeError:
+            return False, None
+        if end >= len(self.buffer) or self.buffer[end] not in _DELIMITERS:
+            return False, None
+        self.pos = end
+        return True, value
+
+    def _step_object(self, events: List[ParseEvent]) -> bool:
+        """Advance through one key/value pair; False when more input is needed"""
+        if self._key is None:
+            self._skip(_WHITESPACE + ",")
+            if self.pos >= len(self.buffer):
+                return False
+            if self.buffer[self.pos] == "}":
+                self.pos += 1
+                self.done = True
+                return False
+            saved = self.pos
+            complete, key = self._decode()
+            if not complete:
+                return False
+            self._skip()
+            if self.pos >= len(self.buffer):
+                self.pos = saved
+                return False
+            self.pos += 1  # ':'
+            self._key = key
+
+        self._skip()
+        if self.pos >= len(self.buffer):
+            return False
+        if self._key in self.streamed_arrays and self.buffer[self.pos] == "[":
+            self.pos += 1
+            self._in_array = True
+            self._array = []
+            return True
+
+        complete, value = self._decode()
+        if not complete:
+            return False
+        events.append(("field", self._key, value))
+        self._key = None
+        return True
+
+    def _step_array(self, events: List[ParseEvent]) -> bool:
+        """Advance through one element of a streamed array"""
+        self._skip(_WHITESPACE + ",")
+        if self.pos >= len(self.buffer):
+            return False
+        if self.buffer[self.pos] == "]":
+            self.pos += 1
+            events.append(("field", self._key, self._array))
+            self._in_array = False
+            self._key = None
+            return True
+        complete, value = self._decode()
+        if not complete:
+            return False
+        self._array.append(value)
+        events.append(("item", self._key, value))
+        return True
@@ -0,0 +1,99 @@
+"""
+Bounded in-process caches
+
+`LRUCache` is the mapping behind the per-process caches (scanner pool, scan
+results, category documents, merchant indexes, data versions and facets).
+`SharedLoader` lets concurrent misses for one key share a single load.
+"""
+import asyncio
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """Mapping of at most `max_size` entries that evicts the least recently used"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max(1, max_size)
+        self._entries: "OrderedDict[K, V]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._entries
+
+    def get(self, key: K) -> Optional[V]:
+        """The entry for `key`, marked as most recently used, or None"""
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def peek(self, key: K) -> Optional[V]:
+        """The entry for `key` without changing its position, or None"""
+        return self._entries.get(key)
+
+    def put(self, key: K, value: V) -> int:
+        """
+        Store an entry as the most recently used
+
+        Returns:
+            Number of entries evicted to stay within `max_size`
+        """
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        evicted = 0
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            evicted += 1
+        return evicted
+
+    def pop(self, key: K) -> Optional[V]:
+        """Remove and return the entry for `key`, or None"""
+        return self._entries.pop(key, None)
+
+    def oldest(self) -> Optional[Tuple[K, V]]:
+        """The least recently used entry, or None when empty"""
+        return next(iter(self._entries.items()), None)
+
+
+class SharedLoader(Generic[K, V]):
+    """
+    One running load per key; concurrent callers await the same task
+
+    A load dropped with `forget` while it runs still answers its callers but
+    is not stored, so an invalidation is never undone by a load that started
+    before it.
+    """
+
+    def __init__(self):
+        self._loading: Dict[K, asyncio.Task] = {}
+
+    async def load(self, key: K, load: Callable[[], Awaitable[V]], store: Callable[[V], None]) -> V:
+        """
+        Await the running load of `key`, or start one
+
+        Args:
+            key: What is being loaded
+            load: Starts the load when none is running
+            store: Called once with the result of a load that was not forgotten
+        """
+        task = self._loading.get(key)
+        if task is None:
+            task = self._loading[key] = asyncio.ensure_future(load())
+        try:
+            # Shielded so one caller's cancellation does not cancel the others' load
+            return await asyncio.shield(task)
+        finally:
+            if task.done() and self._loading.get(key) is task:
+                del self._loading[key]
+                if not task.cancelled() and task.exception() is None:
+                    store(task.result())
+
+    def forget(self, key: K):
+        """Drop the running load of `key`; its result will not be stored"""
+        self._loading.pop(key, None)
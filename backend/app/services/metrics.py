@@ -0,0 +1,80 @@
+"""
+In-process runtime metrics
+"""
+import asyncio
+import os
+import time
+from collections import defaultdict
+from typing import Dict, Optional
+
+# How often the event loop lag probe runs (seconds)
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+
+
+class Metrics:
+    """Simple registry of counters and gauges exposed by `/api/metrics`"""
+
+    def __init__(self):
+        self.counters: Dict[str, float] = defaultdict(float)
+        self.gauges: Dict[str, float] = {}
+
+    def incr(self, name: str, value: float = 1):
+        """Increment a counter"""
+        self.counters[name] += value
+
+    def set_gauge(self, name: str, value: float):
+        """Set a gauge to its current value"""
+        self.gauges[name] = value
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Return a copy of all metrics"""
+        return {
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges)
+        }
+
+
+metrics = Metrics()
+
+
+class EventLoopLagMonitor:
+    """
+    Measures how late the event loop wakes up a sleeping task
+
+    A responsive loop wakes the probe almost exactly on time; blocking calls
+    on the loop show up as lag. Publishes the last and maximum lag (ms) since
+    startup as gauges.
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.max_lag_ms = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the lag probe"""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the lag probe"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag_ms = max(0.0, (time.perf_counter() - started - self.interval) * 1000)
+            self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+            metrics.set_gauge("event_loop_lag_ms", round(lag_ms, 3))
+            metrics.set_gauge("event_loop_lag_max_ms", round(self.max_lag_ms, 3))
+
+
+loop_lag_monitor = EventLoopLagMonitor()
+
+
+def get_metrics() -> Metrics:
+    """Get the global metrics registry"""
+    return metrics
@@ -0,0 +1,318 @@
+"""
+Versioned database migrations run at startup
+
+Each migration runs once per database; applied versions are recorded in the
+`schema_migrations` collection. Migrations must be idempotent, because two
+processes starting together may both run one before either records it.
+Add new steps to the end of `MIGRATIONS` with the next version number.
+
+Long backfills are marked `background`: they and every later migration run
+in a task after startup, so a large database does not hold up the app.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from pymongo import ASCENDING, DESCENDING, IndexModel, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from .database import get_database
+from .search import search_terms
+from .uploads import adopt_file
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_COLLECTION = "schema_migrations"
+MIGRATION_BATCH_SIZE = 500
+
+
+@dataclass
+class Migration:
+    version: int
+    description: str
+    apply: Callable[[object], Awaitable[None]]
+    background: bool = False
+
+
+# One auto-created transaction per receipt
+RECEIPT_TRANSACTION_INDEX = IndexModel(
+    [("user_id", ASCENDING), ("receipt_id", ASCENDING)],
+    name="user_receipt",
+    unique=True,
+    partialFilterExpression={"receipt_id": {"$type": "string"}}
+)
+
+# Indexes matching the query shapes of the routers and services
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "settings": [
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+    ],
+    "categories": [
+        IndexModel([("user_id", ASCENDING), ("type", ASCENDING)], name="user_type"),
+    ],
+    "transactions": [
+        # Listing, date ranges and keyset pagination
+        IndexModel(
+            [("user_id", ASCENDING), ("date", DESCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+            name="user_date_created"
+        ),
+        # Recurring transactions for notifications
+        IndexModel([("user_id", ASCENDING), ("is_recurring", ASCENDING)], name="user_recurring"),
+        # Transactions created from scanned receipts
+        RECEIPT_TRANSACTION_INDEX,
+    ],
+    "receipts": [
+        # Listing and keyset pagination
+        IndexModel([("user_id", ASCENDING), ("scanned_at", DESCENDING), ("_id", DESCENDING)], name="user_scanned"),
+        # Scan queue claims
+        IndexModel([("scan_status", ASCENDING), ("scanned_at", ASCENDING)], name="status_scanned"),
+        # Upload garbage collection reference checks
+        IndexModel([("content_hash", ASCENDING)], name="content_hash"),
+        # Scan stage percentiles
+        IndexModel([("completed_at", DESCENDING)], name="completed_at"),
+    ],
+    "notification_dismissals": [
+        IndexModel(
+            [("user_id", ASCENDING), ("notification_id", ASCENDING)],
+            name="user_notification_unique",
+            unique=True
+        ),
+    ],
+    "upload_blobs": [
+        IndexModel([("refcount", ASCENDING), ("updated_at", ASCENDING)], name="refcount_updated"),
+    ],
+}
+
+
+async def _duplicate_groups(collection, fields: Sequence[str]) -> AsyncIterator[List]:
+    """Ids of the documents sharing the values of `fields`, oldest first, per group"""
+    cursor = collection.aggregate([
+        {"$sort": {"_id": 1}},
+        {"$group": {
+            "_id": {field: f"${field}" for field in fields},
+            "ids": {"$push": "$_id"},
+            "count": {"$sum": 1}
+        }},
+        {"$match": {"count": {"$gt": 1}}}
+    ], allowDiskUse=True)
+    async for group in cursor:
+        yield group["ids"]
+
+
+def _renamed(field: str, value: str, suffix: str) -> str:
+    if field == "email" and "@" in value:
+        local, domain = value.rsplit("@", 1)
+        return f"{local}+{suffix}@{domain}"
+    return f"{value}-{suffix}"
+
+
+async def remove_duplicates(database):
+    """
+    Resolve rows that would break the unique indexes
+
+    Duplicate notification dismissals are deleted. Accounts registered twice
+    by a race keep their data: the oldest keeps the name, later ones get a
+    suffixed username or email and a warning is logged.
+    """
+    dismissals_collection = database["notification_dismissals"]
+    async for ids in _duplicate_groups(dismissals_collection, ("user_id", "notification_id")):
+        await dismissals_collection.delete_many({"_id": {"$in": ids[1:]}})
+
+    users_collection = database["users"]
+    for field in ("username", "email"):
+        async for ids in _duplicate_groups(users_collection, (field,)):
+            for user_id in ids[1:]:
+                user = await users_collection.find_one({"_id": user_id}, {field: 1})
+                if not isinstance(user.get(field), str):
+                    continue
+                value = _renamed(field, user[field], f"dup-{user_id}")
+                await users_collection.update_one({"_id": user_id}, {"$set": {field: value}})
+                logger.warning(f"Renamed duplicate {field} of user {user_id} to {value}")
+
+
+async def create_indexes(database):
+    """Create the declared indexes (no-op for indexes that already exist)"""
+    await remove_duplicates(database)
+    for collection_name, indexes in INDEXES.items():
+        await database[collection_name].create_indexes(indexes)
+
+
+def _to_datetime(value):
+    """Parse an ISO date string into a naive UTC datetime, or None"""
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+async def convert_string_dates(database):
+    """Store transaction dates saved as ISO strings by old clients as dates"""
+    transactions_collection = database["transactions"]
+    fields = ("date", "recurring_end_date", "created_at", "updated_at")
+    cursor = transactions_collection.find(
+        {"$or": [{field: {"$type": "string"}} for field in fields]},
+        {field: 1 for field in fields}
+    )
+    operations = []
+    async for txn in cursor:
+        update = {}
+        for field in fields:
+            if isinstance(txn.get(field), str):
+                parsed = _to_datetime(txn[field])
+                if parsed is not None:
+                    update[field] = parsed
+        if update:
+            operations.append(UpdateOne({"_id": txn["_id"]}, {"$set": update}))
+        if len(operations) >= MIGRATION_BATCH_SIZE:
+            await transactions_collection.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        await transactions_collection.bulk_write(operations, ordered=False)
+
+
+async def index_search_terms(database):
+    """Create the search index and fill `search_terms` on existing transactions"""
+    transactions_collection = database["transactions"]
+    await transactions_collection.create_indexes([
+        IndexModel([("user_id", ASCENDING), ("search_terms", ASCENDING)], name="user_search_terms")
+    ])
+    cursor = transactions_collection.find(
+        {"search_terms": {"$exists": False}},
+        {"merchant_name": 1, "description": 1, "tags": 1, "items.name": 1}
+    )
+    operations = []
+    async for txn in cursor:
+        operations.append(UpdateOne({"_id": txn["_id"]}, {"$set": {"search_terms": search_terms(txn)}}))
+        if len(operations) >= MIGRATION_BATCH_SIZE:
+            await transactions_collection.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        await transactions_collection.bulk_write(operations, ordered=False)
+
+
+async def adopt_legacy_uploads(database):
+    """
+    Move receipt images saved before content addressing into blob storage
+
+    Such receipts have no `content_hash` and no `upload_blobs` entry, so
+    deleting their owner never released the file and the collector never
+    saw it.
+    """
+    receipts_collection = database["receipts"]
+    cursor = receipts_collection.find(
+        {"content_hash": {"$exists": False}, "file_path": {"$type": "string"}},
+        {"file_path": 1}
+    )
+    adopted = 0
+    async for receipt in cursor:
+        path = Path(receipt["file_path"])
+        if not path.is_file():
+            continue
+        upload = await adopt_file(path)
+        await receipts_collection.update_one(
+            {"_id": receipt["_id"]},
+            {"$set": {
+                "content_hash": upload.content_hash,
+                "file_path": str(upload.path),
+                "filename": upload.path.name
+            }}
+        )
+        adopted += 1
+    if adopted:
+        logger.info(f"Moved {adopted} legacy upload(s) into blob storage")
+
+
+async def record_upcoming_transactions(database):
+    """Record each user's earliest future-dated transaction for ETags"""
+    upcoming = database["transactions"].aggregate([
+        {"$match": {"date": {"$gt": datetime.utcnow()}}},
+        {"$group": {"_id": "$user_id", "upcoming": {"$min": "$date"}}}
+    ], allowDiskUse=True)
+    writes = [
+        UpdateOne({"_id": group["_id"]}, {"$min": {"upcoming": group["upcoming"]}, "$inc": {"version": 1}}, upsert=True)
+        async for group in upcoming
+    ]
+    for start in range(0, len(writes), MIGRATION_BATCH_SIZE):
+        await database["data_versions"].bulk_write(writes[start:start + MIGRATION_BATCH_SIZE], ordered=False)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "Create indexes", create_indexes),
+    Migration(2, "Convert legacy string dates on transactions", convert_string_dates),
+    Migration(3, "Index transactions for search", index_search_terms, background=True),
+    Migration(4, "Move legacy uploads into blob storage", adopt_legacy_uploads, background=True),
+    Migration(5, "Record upcoming transactions for ETags", record_upcoming_transactions),
+]
+
+
+_background_task: Optional[asyncio.Task] = None
+
+
+async def run_migrations():
+    """
+    Apply pending migrations in version order
+
+    Returns once the first `background` migration is reached; it and the
+    rest continue in a task (see `stop_migrations`). A failing migration is
+    logged and stops the run, so later migrations never see a half-migrated
+    database; it is retried on the next startup.
+    """
+    global _background_task
+    database = await get_database()
+    migrations_collection = database[MIGRATIONS_COLLECTION]
+    applied = {doc["_id"] async for doc in migrations_collection.find({}, {"_id": 1})}
+    pending = [m for m in sorted(MIGRATIONS, key=lambda m: m.version) if m.version not in applied]
+
+    for index, migration in enumerate(pending):
+        if migration.background:
+            _background_task = asyncio.create_task(_apply_all(database, pending[index:]))
+            return
+        if not await _apply(database, migration):
+            return
+
+
+async def stop_migrations():
+    """Cancel background migrations; they are resumed on the next startup"""
+    global _background_task
+    if _background_task:
+        _background_task.cancel()
+        await asyncio.gather(_background_task, return_exceptions=True)
+        _background_task = None
+
+
+async def _apply_all(database, migrations: List[Migration]):
+    for migration in migrations:
+        if not await _apply(database, migration):
+            return
+
+
+async def _apply(database, migration: Migration) -> bool:
+    """Run one migration and record it; False if it failed"""
+    try:
+        await migration.apply(database)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.exception(f"Migration {migration.version} ({migration.description}) failed")
+        print(f"⚠️  Migration {migration.version} failed: {e}")
+        return False
+    try:
+        await database[MIGRATIONS_COLLECTION].insert_one({
+            "_id": migration.version,
+            "description": migration.description,
+            "applied_at": datetime.utcnow()
+        })
+    except DuplicateKeyError:
+        pass  # Another process recorded it first
+    print(f"✓ Applied migration {migration.version}: {migration.description}")
+    return True
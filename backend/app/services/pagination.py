@@ -0,0 +1,77 @@
+"""
+Keyset (cursor) pagination helpers
+
+A cursor is an opaque token holding the sort key of the last document on a
+page. The next page is selected with a range predicate on that key, so with
+a matching index every page costs the same no matter how deep it is.
+"""
+import base64
+import binascii
+from typing import Any, List, Optional, Sequence, Tuple
+
+from bson import json_util
+from bson.errors import InvalidBSON, InvalidId
+from fastapi import HTTPException, Response, status
+
+# Header carrying the cursor of the next page (absent on the last page)
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+SortSpec = Sequence[Tuple[str, int]]
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Encode sort key values as an opaque URL-safe token"""
+    raw = json_util.dumps(list(values)).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str, length: int) -> List[Any]:
+    """
+    Decode a cursor produced by `encode_cursor`
+
+    Raises:
+        HTTPException: 400 if the token is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json_util.loads(raw)
+    except (binascii.Error, ValueError, TypeError, InvalidId, InvalidBSON):
+        values = None
+    if not isinstance(values, list) or len(values) != length:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+    return values
+
+
+def cursor_for(doc: dict, sort: SortSpec) -> str:
+    """Cursor pointing just past `doc` in the given sort order"""
+    return encode_cursor([doc.get(field) for field, _ in sort])
+
+
+def after_cursor(query: dict, sort: SortSpec, token: Optional[str]) -> dict:
+    """
+    Restrict `query` to the documents after a cursor
+
+    For a sort on (a, b, _id) this adds
+    `a < A or (a == A and b < B) or (a == A and b == B and _id < ID)`
+    (with `>` for ascending fields). The sort must end in a unique field.
+    """
+    if not token:
+        return query
+    values = decode_cursor(token, len(sort))
+    clauses = []
+    for position, (field, direction) in enumerate(sort):
+        clause = {sort[i][0]: values[i] for i in range(position)}
+        clause[field] = {"$lt" if direction < 0 else "$gt": values[position]}
+        clauses.append(clause)
+    if "$or" in query:
+        return {"$and": [query, {"$or": clauses}]}
+    return {**query, "$or": clauses}
+
+
+def set_next_cursor(response: Response, page: List[dict], sort: SortSpec, limit: int):
+    """Advertise the next page's cursor when the page came back full"""
+    if page and len(page) >= limit:
+        response.headers[NEXT_CURSOR_HEADER] = cursor_for(page[-1], sort)
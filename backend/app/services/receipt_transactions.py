@@ -0,0 +1,220 @@
+"""
+Server-side transaction creation for completed receipt scans
+
+When a user enables `auto_create_transaction`, a scan that completes with
+confidence at or above their threshold is turned into an expense right
+away, so the client does not have to send the extracted data back.
+"""
+from datetime import datetime
+from typing import Optional
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from .database import get_collection
+from .metrics import metrics
+from .category_index import get_category_index
+from .search import with_search_terms
+from .data_versions import get_data_versions
+
+DEFAULT_AUTO_CREATE_MIN_CONFIDENCE = 0.8
+
+
+def _to_float(value, default: float = 0.0) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _parse_receipt_date(value) -> datetime:
+    """Parse the model's YYYY-MM-DD date, falling back to now"""
+    if isinstance(value, str):
+        try:
+            return datetime.strptime(value[:10], "%Y-%m-%d").replace(hour=12)
+        except ValueError:
+            pass
+    return datetime.utcnow()
+
+
+def should_auto_create(settings: Optional[dict], extracted_data: dict) -> bool:
+    """Whether the user's settings ask for a transaction for this scan"""
+    if not settings or not settings.get("auto_create_transaction"):
+        return False
+    threshold = settings.get("auto_create_min_confidence", DEFAULT_AUTO_CREATE_MIN_CONFIDENCE)
+    return _to_float(extracted_data.get("confidence"), 0.5) >= threshold
+
+
+def build_transaction_doc(receipt: dict, extracted_data: dict, settings: Optional[dict]) -> Optional[dict]:
+    """
+    Build an expense document from extracted receipt data
+
+    Returns None when the scan has no usable total.
+    """
+    amount = _to_float(extracted_data.get("total_amount"))
+    if amount <= 0:
+        return None
+
+    merchant_name = extracted_data.get("merchant_name") or "Unknown"
+    items = [
+        {
+            "name": item.get("name") or "Unknown item",
+            "quantity": _to_float(item.get("quantity"), 1.0) or 1.0,
+            "unit_price": _to_float(item.get("unit_price")),
+            "total_price": _to_float(item.get("total_price"))
+        }
+        for item in extracted_data.get("items") or []
+        if isinstance(item, dict)
+    ]
+    now = datetime.utcnow()
+    return with_search_terms({
+        "_id": ObjectId(),
+        "user_id": receipt["user_id"],
+        "type": "expense",
+        "amount": amount,
+        "currency": extracted_data.get("currency") or (settings or {}).get("default_currency", "€"),
+        "category_id": extracted_data.get("category_id"),
+        "category_name": extracted_data.get("category_name"),
+        "merchant_name": merchant_name,
+        "description": f"Receipt from {merchant_name}",
+        "date": _parse_receipt_date(extracted_data.get("date")),
+        "items": items,
+        "receipt_id": str(receipt["_id"]),
+        "tags": [],
+        "is_recurring": False,
+        "recurring_frequency": None,
+        "recurring_interval": 1,
+        "recurring_end_date": None,
+        "created_at": now,
+        "updated_at": now
+    })
+
+
+async def _already_booked(receipt: dict) -> bool:
+    """
+    Whether another receipt with the same image already has a transaction
+
+    Re-uploading a photo (a scan cache hit) must not book the expense twice.
+    """
+    content_hash = receipt.get("content_hash")
+    if not content_hash:
+        return False
+    receipts_collection = await get_collection("receipts")
+    cursor = receipts_collection.find(
+        {
+            "user_id": receipt["user_id"],
+            "content_hash": content_hash,
+            "transaction_id": {"$type": "string"},
+            "_id": {"$ne": receipt.get("_id")}
+        },
+        {"transaction_id": 1}
+    )
+    transaction_ids = [ObjectId(doc["transaction_id"]) async for doc in cursor if ObjectId.is_valid(doc["transaction_id"])]
+    if not transaction_ids:
+        return False
+    # The earlier transaction may have been deleted since
+    transactions_collection = await get_collection("transactions")
+    existing = await transactions_collection.find_one(
+        {"_id": {"$in": transaction_ids}, "user_id": receipt["user_id"]},
+        {"_id": 1}
+    )
+    if existing is None:
+        return False
+    metrics.incr("auto_create_duplicates_skipped")
+    return True
+
+
+async def _transaction_to_create(receipt: dict, extracted_data: dict, settings: Optional[dict]) -> Optional[dict]:
+    """The transaction to auto-create for a completed scan, if any"""
+    if not should_auto_create(settings, extracted_data) or await _already_booked(receipt):
+        return None
+    return build_transaction_doc(receipt, extracted_data, settings)
+
+
+async def _upsert_for_receipt(txn_doc: dict):
+    """Insert the receipt's transaction unless it exists; None if a concurrent upsert won"""
+    transactions_collection = await get_collection("transactions")
+    try:
+        return await transactions_collection.update_one(
+            {"user_id": txn_doc["user_id"], "receipt_id": txn_doc["receipt_id"]},
+            {"$setOnInsert": txn_doc},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return None
+
+
+def _record_category(txn_doc: dict):
+    get_category_index().record(
+        txn_doc["user_id"], txn_doc["merchant_name"], txn_doc["category_id"], txn_doc["category_name"]
+    )
+
+
+async def complete_receipt(receipt: dict, update_doc: dict, settings: Optional[dict]) -> dict:
+    """
+    Store a completed scan, creating its transaction if the user wants one
+
+    The transaction is written first, so a receipt never points at a
+    transaction that failed to insert. The insert is an upsert keyed on
+    `receipt_id`, so a receipt that is scanned again (e.g. after a worker
+    crash) never gets a second transaction.
+
+    Args:
+        receipt: Receipt document; must carry `_id` and `user_id`
+        update_doc: Fields to `$set` on the receipt
+        settings: The user's settings document, if any
+
+    Returns:
+        `update_doc`, with `transaction_id` added when a transaction was created
+    """
+    receipts_collection = await get_collection("receipts")
+    extracted_data = update_doc.get("extracted_data") or {}
+    txn_doc = await _transaction_to_create(receipt, extracted_data, settings)
+
+    if txn_doc is None:
+        await receipts_collection.update_one({"_id": receipt["_id"]}, {"$set": update_doc})
+        return update_doc
+
+    transactions_collection = await get_collection("transactions")
+    txn_result = await _upsert_for_receipt(txn_doc)
+    if txn_result is not None and txn_result.upserted_id is not None:
+        transaction_id = txn_doc["_id"]
+    else:
+        # Materialized by an earlier attempt or a concurrent completion - point at that one
+        existing = await transactions_collection.find_one(
+            {"user_id": txn_doc["user_id"], "receipt_id": txn_doc["receipt_id"]},
+            {"_id": 1}
+        )
+        transaction_id = existing["_id"]
+
+    update_doc = {**update_doc, "transaction_id": str(transaction_id)}
+    await receipts_collection.update_one({"_id": receipt["_id"]}, {"$set": update_doc})
+    if transaction_id == txn_doc["_id"]:
+        _record_category(txn_doc)
+        await get_data_versions().bump(txn_doc["user_id"])
+    return update_doc
+
+
+async def insert_completed_receipt(receipt_doc: dict, settings: Optional[dict]) -> dict:
+    """
+    Insert a receipt that is already completed (e.g. a scan cache hit)
+
+    Like `complete_receipt`, the transaction is inserted before the receipt
+    that points at it. Sets `_id` (and `transaction_id`) on `receipt_doc`.
+    """
+    receipts_collection = await get_collection("receipts")
+    receipt_doc.setdefault("_id", ObjectId())
+    extracted_data = receipt_doc.get("extracted_data") or {}
+    txn_doc = await _transaction_to_create(receipt_doc, extracted_data, settings)
+
+    if txn_doc is None:
+        await receipts_collection.insert_one(receipt_doc)
+        return receipt_doc
+
+    transactions_collection = await get_collection("transactions")
+    await transactions_collection.insert_one(txn_doc)
+    receipt_doc["transaction_id"] = str(txn_doc["_id"])
+    await receipts_collection.insert_one(receipt_doc)
+    _record_category(txn_doc)
+    await get_data_versions().bump(txn_doc["user_id"])
+    return receipt_doc
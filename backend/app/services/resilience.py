@@ -0,0 +1,237 @@
+"""
+Rate limiting, retries and circuit breaking for AI provider calls
+
+Calls are queued behind a per-API-key token bucket, retried with jittered
+exponential backoff on retryable errors, and rejected immediately while the
+circuit breaker is open because the provider looks down.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+from google.api_core import exceptions as google_exceptions
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Token bucket per API key (0 = unlimited)
+AI_RATE_PER_MINUTE = float(os.getenv("AI_RATE_PER_MINUTE", "60"))
+AI_RATE_BURST = int(os.getenv("AI_RATE_BURST", "5"))
+
+# Per-attempt deadline, enforced by the backend's client
+AI_CALL_TIMEOUT = float(os.getenv("AI_CALL_TIMEOUT", "60"))
+
+# Retries with jittered exponential backoff
+AI_MAX_RETRIES = int(os.getenv("AI_MAX_RETRIES", "3"))
+AI_RETRY_BASE_DELAY = float(os.getenv("AI_RETRY_BASE_DELAY", "1"))
+AI_RETRY_MAX_DELAY = float(os.getenv("AI_RETRY_MAX_DELAY", "30"))
+
+# Circuit breaker
+AI_BREAKER_THRESHOLD = int(os.getenv("AI_BREAKER_THRESHOLD", "5"))
+AI_BREAKER_RESET = float(os.getenv("AI_BREAKER_RESET", "30"))
+
+# Provider is throttling this key - retry, but the provider itself is up
+THROTTLING_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+)
+
+# Provider looks unhealthy - retry and count towards the circuit breaker
+PROVIDER_ERRORS = (
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.GatewayTimeout,
+    asyncio.TimeoutError,
+    ConnectionError,
+)
+
+
+class CircuitOpenError(Exception):
+    """Raised when calls are rejected because the provider looks down"""
+
+
+class TokenBucket:
+    """Token bucket that makes callers wait (in FIFO order) for a token"""
+
+    def __init__(self, rate_per_second: float, capacity: int):
+        self.rate = rate_per_second
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> float:
+        """
+        Take one token, waiting if necessary
+
+        Returns:
+            Seconds spent waiting
+        """
+        waited = 0.0
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+
+
+class RateLimiter:
+    """One token bucket per API key"""
+
+    def __init__(self, per_minute: float = AI_RATE_PER_MINUTE, burst: int = AI_RATE_BURST):
+        self.per_minute = per_minute
+        self.burst = burst
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    async def acquire(self, key: str):
+        """Wait for permission to call the provider with `key`"""
+        if self.per_minute <= 0:
+            return
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.per_minute / 60, self.burst)
+        waited = await bucket.acquire()
+        if waited > 0:
+            metrics.incr("ai_throttled_calls")
+            metrics.incr("ai_throttle_wait_seconds", waited)
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker
+
+    Opens after `threshold` provider failures in a row. After `reset_timeout`
+    seconds one trial call is let through (half-open); its outcome closes or
+    re-opens the breaker.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    _GAUGE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, threshold: int = AI_BREAKER_THRESHOLD, reset_timeout: float = AI_BREAKER_RESET):
+        self.threshold = max(1, threshold)
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go through"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                metrics.incr("ai_breaker_rejections")
+                raise CircuitOpenError("AI provider is unavailable, please try again later")
+            self._set_state(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            if self._trial_in_flight:
+                metrics.incr("ai_breaker_rejections")
+                raise CircuitOpenError("AI provider is unavailable, please try again later")
+            self._trial_in_flight = True
+
+    def release(self):
+        """Give up a call slot without an outcome (e.g. cancellation)"""
+        self._trial_in_flight = False
+
+    def record_success(self):
+        self._trial_in_flight = False
+        self.failures = 0
+        if self.state != self.CLOSED:
+            self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        self._trial_in_flight = False
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+            if self.state != self.OPEN:
+                logger.warning("AI circuit breaker opened")
+                metrics.incr("ai_breaker_opened")
+            self._set_state(self.OPEN)
+
+    def _set_state(self, state: str):
+        self.state = state
+        metrics.set_gauge("ai_breaker_state", self._GAUGE[state])
+
+
+rate_limiter = RateLimiter()
+circuit_breaker = CircuitBreaker()
+
+
+def _backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff"""
+    return random.uniform(0, min(AI_RETRY_MAX_DELAY, AI_RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+async def call_ai(
+    key: Optional[str],
+    func: Callable[[], Awaitable[T]],
+    on_retry: Optional[Callable[[Exception], None]] = None
+) -> T:
+    """
+    Call the AI provider with rate limiting, retries and circuit breaking
+
+    Each attempt's deadline (AI_CALL_TIMEOUT) is enforced by the backend's
+    client rather than here: cancelling the awaitable would not stop a call
+    running in the AI thread pool, and time spent waiting for a free thread
+    must not count as a provider failure.
+
+    Args:
+        key: API key used for the call (rate limits are per key)
+        func: Factory returning a fresh awaitable for each attempt
+        on_retry: Called with the error before each retry
+
+    Raises:
+        CircuitOpenError: If the breaker rejects the call
+        Exception: The last error once retries are exhausted, or any
+            non-retryable error
+    """
+    attempt = 0
+    while True:
+        circuit_breaker.before_call()
+        try:
+            await rate_limiter.acquire(key or "")
+            result = await func()
+        except PROVIDER_ERRORS as e:
+            circuit_breaker.record_failure()
+            error = e
+        except THROTTLING_ERRORS as e:
+            circuit_breaker.record_success()
+            metrics.incr("ai_provider_throttled")
+            error = e
+        except asyncio.CancelledError:
+            circuit_breaker.release()
+            raise
+        except Exception:
+            # Non-retryable: the provider answered, so it is up
+            circuit_breaker.record_success()
+            raise
+        else:
+            circuit_breaker.record_success()
+            return result
+
+        if attempt >= AI_MAX_RETRIES:
+            metrics.incr("ai_retries_exhausted")
+            raise error
+        delay = _backoff_delay(attempt)
+        attempt += 1
+        metrics.incr("ai_retries")
+        if on_retry is not None:
+            on_retry(error)
+        logger.warning(f"Retrying AI call in {delay:.1f}s (attempt {attempt}/{AI_MAX_RETRIES}): {error}")
+        await asyncio.sleep(delay)
@@ -0,0 +1,75 @@
+"""
+Content-hash deduplication cache for receipt scans
+
+Maps the SHA-256 of an uploaded image to the `extracted_data` of a completed
+scan. Entries persist in the `scan_cache` collection and the hottest ones are
+kept in an in-process LRU.
+"""
+import os
+from datetime import datetime
+from typing import Optional
+
+from .database import get_collection
+from .lru import LRUCache
+from .metrics import metrics
+
+SCAN_CACHE_SIZE = int(os.getenv("SCAN_CACHE_SIZE", "1024"))
+
+
+class ScanCache:
+    """Two-level (LRU + MongoDB) cache of scan results keyed by content hash"""
+
+    def __init__(self, max_size: int = SCAN_CACHE_SIZE):
+        self._entries: LRUCache[str, dict] = LRUCache(max_size)
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, digest: str, record: bool = True) -> Optional[dict]:
+        """
+        Return the stored extraction for a content hash, if any
+
+        Args:
+            digest: SHA-256 of the uploaded bytes
+            record: Count the lookup towards the upload hit rate
+        """
+        extracted_data = self._entries.get(digest)
+        if extracted_data is None:
+            cache_collection = await get_collection("scan_cache")
+            entry = await cache_collection.find_one({"_id": digest})
+            if entry:
+                extracted_data = entry["extracted_data"]
+                self._entries.put(digest, extracted_data)
+
+        if record:
+            self._record(extracted_data is not None)
+        return extracted_data
+
+    async def put(self, digest: str, extracted_data: dict):
+        """Store the extraction of a completed scan"""
+        self._entries.put(digest, extracted_data)
+        cache_collection = await get_collection("scan_cache")
+        await cache_collection.update_one(
+            {"_id": digest},
+            {
+                "$set": {"extracted_data": extracted_data},
+                "$setOnInsert": {"created_at": datetime.utcnow()}
+            },
+            upsert=True
+        )
+
+    def _record(self, hit: bool):
+        if hit:
+            self.hits += 1
+            metrics.incr("scan_cache_hits")
+        else:
+            self.misses += 1
+            metrics.incr("scan_cache_misses")
+        metrics.set_gauge("scan_cache_hit_rate", round(self.hits / (self.hits + self.misses), 4))
+
+
+scan_cache = ScanCache()
+
+
+def get_scan_cache() -> ScanCache:
+    """Get the global scan cache"""
+    return scan_cache
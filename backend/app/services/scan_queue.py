@@ -0,0 +1,349 @@
+"""
+Background receipt scan queue
+
+Uploads are stored as `pending` receipts; a pool of workers claims them
+from MongoDB and drives them through `processing` to `completed` or `failed`.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import AsyncIterator, List, Optional
+
+from pymongo import ReturnDocument
+
+from .database import get_collection
+from .ai_scanner import get_scanner
+from .scanner_backends import run_blocking
+from .image_preprocessing import preprocess_image
+from .scan_cache import get_scan_cache
+from .metrics import metrics
+from .events import publish_scan_status, publish_scan_partial
+from .receipt_transactions import complete_receipt
+from .category_index import attach_predicted_category
+from .scan_stats import ScanStats, elapsed_ms
+
+logger = logging.getLogger(__name__)
+
+# Queue configuration
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", "2"))
+SCAN_POLL_INTERVAL = float(os.getenv("SCAN_POLL_INTERVAL", "5"))
+SCAN_JOB_TIMEOUT = int(os.getenv("SCAN_JOB_TIMEOUT", "300"))
+# Claims are refreshed this often while a scan is queued or running here
+SCAN_HEARTBEAT_INTERVAL = SCAN_JOB_TIMEOUT / 3
+# Claims per receipt before giving up (e.g. an image that crashes the process)
+SCAN_MAX_ATTEMPTS = int(os.getenv("SCAN_MAX_ATTEMPTS", "3"))
+
+# Batch scan limits (rate is scans started per second, 0 = unlimited)
+BATCH_SCAN_CONCURRENCY = int(os.getenv("BATCH_SCAN_CONCURRENCY", "4"))
+BATCH_SCAN_RATE = float(os.getenv("BATCH_SCAN_RATE", "0"))
+
+
+class ScanQueue:
+    """
+    Pool of background workers that process pending receipt scans
+
+    Workers sleep until woken by `notify()` or until the poll interval
+    elapses, so receipts inserted by other processes are picked up as well.
+    Receipts stuck in `processing` longer than the job timeout (e.g. after
+    a crash) are claimed again, up to SCAN_MAX_ATTEMPTS times.
+    """
+
+    def __init__(self, workers: int = SCAN_WORKERS):
+        self.workers = max(1, workers)
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+
+    async def start(self):
+        """Start the worker pool"""
+        self._wakeup = asyncio.Event()
+        for index in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(index)))
+        print(f"✓ Started {self.workers} receipt scan worker(s)")
+
+    async def stop(self):
+        """Cancel all workers and wait for them to exit"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Wake idle workers after a new receipt was queued"""
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def _claim(self) -> Optional[dict]:
+        """Atomically move the oldest claimable receipt to `processing`"""
+        receipts_collection = await get_collection("receipts")
+        now = datetime.utcnow()
+        stale_before = now - timedelta(seconds=SCAN_JOB_TIMEOUT)
+        return await receipts_collection.find_one_and_update(
+            {"$or": [
+                {"scan_status": "pending"},
+                {"scan_status": "processing", "processing_started_at": {"$lt": stale_before}}
+            ]},
+            {
+                "$set": {"scan_status": "processing", "processing_started_at": now},
+                "$inc": {"attempts": 1}
+            },
+            sort=[("scanned_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _worker(self, index: int):
+        """Claim and process receipts until cancelled"""
+        while True:
+            # Clear before claiming so a notify() during the claim is not lost
+            self._wakeup.clear()
+            try:
+                receipt = await self._claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Scan worker {index} failed to claim a receipt: {e}")
+                receipt = None
+
+            if receipt is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=SCAN_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            if receipt.get("attempts", 0) > SCAN_MAX_ATTEMPTS:
+                metrics.incr("scan_attempts_exhausted")
+                await _try_mark_failed(receipt, f"Scan gave up after {SCAN_MAX_ATTEMPTS} attempts")
+                continue
+
+            heartbeat = asyncio.create_task(_heartbeat({receipt["_id"]}))
+            try:
+                await process_receipt(receipt)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Scan worker {index} crashed on receipt {receipt['_id']}: {e}")
+                await _try_mark_failed(receipt, str(e))
+            finally:
+                heartbeat.cancel()
+
+
+async def _heartbeat(receipt_ids: set):
+    """
+    Keep the claim on receipts this process is still working on
+
+    Refreshes `processing_started_at` so `ScanQueue._claim` does not take
+    a slow scan, or a batch job still waiting for a slot, as abandoned.
+    Receipts removed from `receipt_ids` are no longer refreshed.
+    """
+    receipts_collection = await get_collection("receipts")
+    while True:
+        await asyncio.sleep(SCAN_HEARTBEAT_INTERVAL)
+        if not receipt_ids:
+            continue
+        try:
+            await receipts_collection.update_many(
+                {"_id": {"$in": list(receipt_ids)}, "scan_status": "processing"},
+                {"$set": {"processing_started_at": datetime.utcnow()}}
+            )
+        except Exception as e:
+            logger.warning(f"Failed to refresh scan claims: {e}")
+
+
+async def _mark_failed(
+    receipt: dict,
+    error_message: str,
+    extracted_data: Optional[dict] = None,
+    stats: Optional[ScanStats] = None
+):
+    """Record a failed scan"""
+    update_doc = {
+        "scan_status": "failed",
+        "error_message": error_message,
+        "completed_at": datetime.utcnow()
+    }
+    if extracted_data is not None:
+        update_doc["extracted_data"] = extracted_data
+    _add_stats(receipt, update_doc, stats)
+    await _finish(receipt, update_doc)
+
+
+async def _try_mark_failed(receipt: dict, error_message: str):
+    """
+    Record a failed scan after a crash, logging instead of raising
+
+    The crash may have been the database itself; the receipt then stays in
+    `processing` and is claimed again after the job timeout.
+    """
+    try:
+        await _mark_failed(receipt, error_message)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to mark receipt {receipt['_id']} as failed: {e}")
+
+
+async def _mark_completed(
+    receipt: dict,
+    extracted_data: dict,
+    settings: Optional[dict] = None,
+    cache_hit: bool = False,
+    stats: Optional[ScanStats] = None
+):
+    """Record a completed scan, creating its transaction if the user opted in"""
+    extracted_data = await attach_predicted_category(receipt["user_id"], extracted_data)
+    update_doc = {
+        "scan_status": "completed",
+        "ai_confidence": extracted_data.get("confidence", 0.5),
+        "extracted_data": extracted_data,
+        "cache_hit": cache_hit,
+        "completed_at": datetime.utcnow()
+    }
+    _add_stats(receipt, update_doc, stats)
+    update_doc = await complete_receipt(receipt, update_doc, settings)
+    publish_scan_status({**receipt, **update_doc})
+
+
+def _add_stats(receipt: dict, update_doc: dict, stats: Optional[ScanStats]):
+    """Store the scan's measurements with its final state and count them"""
+    if stats is None:
+        return
+    stats.total_ms = elapsed_ms(receipt["scanned_at"], update_doc["completed_at"])
+    update_doc["scan_stats"] = stats.to_doc()
+    stats.publish()
+
+
+async def _finish(receipt: dict, update_doc: dict):
+    """Store the final state of a scan and notify the user's subscribers"""
+    receipts_collection = await get_collection("receipts")
+    await receipts_collection.update_one({"_id": receipt["_id"]}, {"$set": update_doc})
+    publish_scan_status({**receipt, **update_doc})
+
+
+async def process_receipt(receipt: dict):
+    """
+    Run the AI scan for a claimed receipt and store the outcome
+
+    Args:
+        receipt: Receipt document already moved to `processing`
+    """
+    stats = ScanStats(queue_wait_ms=elapsed_ms(receipt["scanned_at"]))
+    publish_scan_status(receipt)
+
+    # Load user's API key and transaction preferences from settings
+    settings_collection = await get_collection("settings")
+    user_settings = await settings_collection.find_one({"user_id": receipt["user_id"]})
+
+    # A duplicate upload may have completed while this one was queued
+    digest = receipt.get("content_hash")
+    extracted_data = await get_scan_cache().get(digest, record=False) if digest else None
+    if extracted_data is not None:
+        metrics.incr("scan_cache_late_hits")
+        await _mark_completed(receipt, extracted_data, user_settings, cache_hit=True, stats=stats)
+        return
+
+    scanner = get_scanner((user_settings or {}).get("gemini_api_key"))
+    if scanner is None:
+        # No API key in settings and no default key
+        await _mark_failed(receipt, "Gemini API key not configured. Please set it in settings.", stats=stats)
+        return
+
+    started = time.perf_counter()
+    try:
+        prepared = await run_blocking(preprocess_image, receipt["file_path"])
+    except Exception as e:
+        await _mark_failed(receipt, f"Could not read receipt image: {e}", stats=stats)
+        return
+    # Sizes are kept so preprocessing settings can be tuned against confidence
+    stats.preprocess_ms = (time.perf_counter() - started) * 1000
+    stats.upload_bytes = prepared.original_bytes
+    stats.preprocessed_bytes = prepared.processed_bytes
+
+    try:
+        extracted_data = await scanner.scan_image(
+            prepared,
+            on_partial=lambda kind, field, value: publish_scan_partial(receipt, kind, field, value),
+            stats=stats
+        )
+    except Exception as e:
+        await _mark_failed(receipt, f"Failed to scan receipt: {e}", stats=stats)
+        return
+
+    # Check for errors
+    if "error" in extracted_data:
+        await _mark_failed(receipt, extracted_data["error"], extracted_data, stats=stats)
+        return
+
+    if digest:
+        await get_scan_cache().put(digest, extracted_data)
+    await _mark_completed(receipt, extracted_data, user_settings, stats=stats)
+
+
+async def scan_batch(
+    receipts: List[dict],
+    concurrency: int = BATCH_SCAN_CONCURRENCY,
+    rate: float = BATCH_SCAN_RATE
+) -> AsyncIterator[dict]:
+    """
+    Scan a batch of receipts concurrently, yielding each as it finishes
+
+    The receipts must already be in `processing` so queue workers leave
+    them alone; their claims are refreshed until each scan finishes, however
+    long it waits for a slot. If the consumer stops early the remaining
+    scans are cancelled; queue workers reclaim them after the job timeout.
+
+    Args:
+        receipts: Inserted receipt documents
+        concurrency: Maximum scans in flight for this batch
+        rate: Maximum scans started per second (0 = unlimited)
+
+    Yields:
+        Final receipt documents in completion order
+    """
+    receipts_collection = await get_collection("receipts")
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    loop = asyncio.get_running_loop()
+    interval = 1 / rate if rate > 0 else 0
+    next_start = loop.time()
+
+    unfinished = {receipt["_id"] for receipt in receipts}
+
+    async def run(receipt: dict) -> dict:
+        nonlocal next_start
+        async with semaphore:
+            if interval:
+                start = max(loop.time(), next_start)
+                next_start = start + interval
+                await asyncio.sleep(start - loop.time())
+            try:
+                await process_receipt(receipt)
+            except Exception as e:
+                logger.error(f"Batch scan crashed on receipt {receipt['_id']}: {e}")
+                await _try_mark_failed(receipt, str(e))
+            finally:
+                unfinished.discard(receipt["_id"])
+        try:
+            return await receipts_collection.find_one({"_id": receipt["_id"]})
+        except Exception as e:
+            logger.error(f"Failed to reload batch receipt {receipt['_id']}: {e}")
+            return {**receipt, "scan_status": "failed", "error_message": str(e)}
+
+    heartbeat = asyncio.create_task(_heartbeat(unfinished))
+    tasks = [asyncio.create_task(run(receipt)) for receipt in receipts]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        heartbeat.cancel()
+        for task in tasks:
+            task.cancel()
+
+
+# Global queue instance (started from the application lifespan)
+scan_queue = ScanQueue()
+
+
+def get_scan_queue() -> ScanQueue:
+    """Get the global scan queue instance"""
+    return scan_queue
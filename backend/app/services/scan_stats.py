@@ -0,0 +1,107 @@
+"""
+Per-scan latency, payload and token accounting
+
+Each scan fills a `ScanStats` as it moves through the pipeline. The result
+is stored on the receipt as `scan_stats`, added to the runtime counters, and
+summarized as percentiles per stage for the admin metrics endpoint.
+"""
+import math
+import os
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from .database import get_collection
+from .metrics import metrics
+
+# Most recent scans considered when computing percentiles
+SCAN_STATS_SAMPLE_LIMIT = int(os.getenv("SCAN_STATS_SAMPLE_LIMIT", "10000"))
+
+PERCENTILES = (50, 95, 99)
+
+
+@dataclass
+class ScanStats:
+    """Measurements for one scan; fields stay None for stages that did not run"""
+    queue_wait_ms: Optional[float] = None  # Upload until a worker picked the scan up
+    preprocess_ms: Optional[float] = None
+    ai_call_ms: Optional[float] = None  # Whole provider call incl. throttling and retries
+    model_ms: Optional[float] = None  # Successful model attempt only
+    parse_ms: Optional[float] = None
+    total_ms: Optional[float] = None  # Upload until the result was stored
+    upload_bytes: Optional[int] = None
+    preprocessed_bytes: Optional[int] = None
+    prompt_tokens: Optional[int] = None
+    response_tokens: Optional[int] = None
+    retries: int = 0
+
+    def record_usage(self, usage_metadata):
+        """Take token counts from a Gemini response's `usage_metadata`"""
+        prompt_tokens = usage_metadata.prompt_token_count
+        response_tokens = usage_metadata.candidates_token_count
+        if prompt_tokens:
+            self.prompt_tokens = prompt_tokens
+        if response_tokens:
+            self.response_tokens = response_tokens
+
+    def to_doc(self) -> Dict[str, float]:
+        """Measured fields, for storing on the receipt"""
+        return {
+            name: round(value, 1) if isinstance(value, float) else value
+            for name, value in asdict(self).items()
+            if value is not None
+        }
+
+    def publish(self):
+        """Add this scan's measurements to the runtime counters"""
+        metrics.incr("scan_stats_count")
+        for name, value in self.to_doc().items():
+            metrics.incr(f"scan_stats_{name}_sum", value)
+
+
+def elapsed_ms(started: datetime, finished: Optional[datetime] = None) -> float:
+    """Milliseconds between two UTC timestamps"""
+    return ((finished or datetime.utcnow()) - started).total_seconds() * 1000
+
+
+def _percentile(sorted_values: List[float], percentile: int) -> float:
+    """Nearest-rank percentile of an ascending list"""
+    rank = max(1, math.ceil(percentile / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+async def scan_stage_percentiles(window_seconds: int) -> dict:
+    """
+    p50/p95/p99 of every scan stage over the last `window_seconds`
+
+    Uses at most SCAN_STATS_SAMPLE_LIMIT of the most recently finished scans.
+    """
+    receipts_collection = await get_collection("receipts")
+    since = datetime.utcnow() - timedelta(seconds=window_seconds)
+    cursor = receipts_collection.find(
+        {"completed_at": {"$gte": since}, "scan_stats": {"$exists": True}},
+        {"scan_stats": 1}
+    ).sort("completed_at", -1).limit(SCAN_STATS_SAMPLE_LIMIT)
+
+    samples: Dict[str, List[float]] = {name: [] for name in ScanStats.__dataclass_fields__}
+    scans = 0
+    async for receipt in cursor:
+        scans += 1
+        for name, value in receipt["scan_stats"].items():
+            if name in samples and value is not None:
+                samples[name].append(value)
+
+    stages = {}
+    for name, values in samples.items():
+        if not values:
+            continue
+        values.sort()
+        stages[name] = {"count": len(values)}
+        for percentile in PERCENTILES:
+            stages[name][f"p{percentile}"] = _percentile(values, percentile)
+
+    return {
+        "window_seconds": window_seconds,
+        "scans": scans,
+        "stages": stages
+    }
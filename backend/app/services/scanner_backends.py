@@ -0,0 +1,295 @@
+"""
+Model backends for the receipt scanner
+
+`GeminiReceiptScanner` builds the prompt and parses the answer; a backend
+only turns a prompt and an image into response text. Besides the real
+Gemini backend there is an offline replay backend for load tests and CI,
+and a recording wrapper that captures real responses as replay fixtures.
+
+Select the backend with SCANNER_BACKEND=gemini|replay|record.
+"""
+import asyncio
+import io
+import json
+import logging
+from abc import ABC, abstractmethod
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+import aiofiles
+from google.ai import generativelanguage as glm
+from google.api_core import client_options as client_options_lib
+from PIL import Image
+
+from .image_preprocessing import PreparedImage
+from .metrics import metrics
+from .resilience import AI_CALL_TIMEOUT
+from .scan_stats import ScanStats
+
+logger = logging.getLogger(__name__)
+
+# Blocking Gemini/PIL calls run in this bounded pool, never on the event loop
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "4"))
+_executor = ThreadPoolExecutor(max_workers=AI_MAX_CONCURRENCY, thread_name_prefix="ai-scan")
+
+# Backend selection
+SCANNER_BACKEND = os.getenv("SCANNER_BACKEND", "gemini")
+SCANNER_FIXTURES_DIR = Path(os.getenv("SCANNER_FIXTURES_DIR", "/app/fixtures/scans"))
+# Seconds of artificial latency per replayed scan, or "recorded"
+SCANNER_REPLAY_LATENCY = os.getenv("SCANNER_REPLAY_LATENCY", "0")
+REPLAY_CHUNK_SIZE = 64
+
+MODEL_NAME = 'gemini-2.5-flash-lite'
+
+
+async def run_blocking(func, *args):
+    """Run a blocking callable in the AI thread pool"""
+    loop = asyncio.get_running_loop()
+    metrics.incr("ai_executor_submitted")
+    metrics.incr("ai_executor_in_flight")
+    try:
+        return await loop.run_in_executor(_executor, func, *args)
+    finally:
+        metrics.incr("ai_executor_in_flight", -1)
+
+
+class ScannerBackend(ABC):
+    """Interface for the model call behind the receipt scanner"""
+
+    @abstractmethod
+    async def generate(self, prompt: str, prepared: PreparedImage, stats: Optional[ScanStats] = None) -> str:
+        """
+        Run the model on a receipt image
+
+        Args:
+            prompt: Extraction prompt
+            prepared: Preprocessed receipt image
+            stats: Receives token counts, when the backend knows them
+
+        Returns:
+            Raw response text
+        """
+
+    async def generate_stream(
+        self,
+        prompt: str,
+        prepared: PreparedImage,
+        stats: Optional[ScanStats] = None
+    ) -> AsyncIterator[str]:
+        """
+        Run the model and yield the response text in chunks as it is generated
+
+        Backends without native streaming yield the whole response at once.
+        """
+        yield await self.generate(prompt, prepared, stats)
+
+
+def _image_mime_type(image_data: bytes) -> str:
+    """MIME type of encoded image bytes (reads the header only)"""
+    with Image.open(io.BytesIO(image_data)) as img:
+        return Image.MIME.get(img.format, "image/jpeg")
+
+
+def _response_text(response) -> str:
+    """Text of the first candidate of a GenerateContentResponse ("" if none)"""
+    if not response.candidates:
+        return ""
+    return "".join(part.text for part in response.candidates[0].content.parts)
+
+
+def _check_usage(stats: Optional[ScanStats]):
+    """Complain when a Gemini call reported no token counts"""
+    if stats is not None and stats.prompt_tokens is None:
+        metrics.incr("scan_usage_missing")
+        logger.warning("Gemini response carried no usage metadata; token counts not recorded")
+
+
+class GeminiBackend(ScannerBackend):
+    """Google Gemini backend with a client bound to one API key"""
+
+    def __init__(self, api_key: str):
+        # google-generativeai only configures one process-wide key
+        # (`genai.configure`), so each backend talks to the public
+        # generativelanguage client directly with its own key
+        self.client = glm.GenerativeServiceClient(
+            client_options=client_options_lib.ClientOptions(api_key=api_key)
+        )
+
+    async def generate(self, prompt: str, prepared: PreparedImage, stats: Optional[ScanStats] = None) -> str:
+        response = await run_blocking(self._generate, prompt, prepared.data)
+        if stats is not None:
+            stats.record_usage(response.usage_metadata)
+            _check_usage(stats)
+        text = _response_text(response)
+        if not text:
+            raise ValueError("Gemini returned no text (the request may have been blocked)")
+        return text
+
+    def _request(self, prompt: str, image_data: bytes) -> glm.GenerateContentRequest:
+        return glm.GenerateContentRequest(
+            model=f"models/{MODEL_NAME}",
+            contents=[glm.Content(role="user", parts=[
+                glm.Part(text=prompt),
+                glm.Part(inline_data=glm.Blob(mime_type=_image_mime_type(image_data), data=image_data))
+            ])]
+        )
+
+    def _generate(self, prompt: str, image_data: bytes):
+        """Call Gemini (blocking, runs in the thread pool)"""
+        # The deadline is enforced by the client, so a slow call frees its thread
+        return self.client.generate_content(request=self._request(prompt, image_data), timeout=AI_CALL_TIMEOUT)
+
+    async def generate_stream(
+        self,
+        prompt: str,
+        prepared: PreparedImage,
+        stats: Optional[ScanStats] = None
+    ) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stopped = threading.Event()
+        finished = object()
+
+        def produce():
+            # Runs in the thread pool and hands chunks back to the event loop
+            try:
+                request = self._request(prompt, prepared.data)
+                for chunk in self.client.stream_generate_content(request=request, timeout=AI_CALL_TIMEOUT):
+                    if stopped.is_set():
+                        break
+                    if stats is not None:
+                        # Usage is reported on the final chunk
+                        loop.call_soon_threadsafe(stats.record_usage, chunk.usage_metadata)
+                    text = _response_text(chunk)
+                    if text:
+                        loop.call_soon_threadsafe(queue.put_nowait, text)
+                loop.call_soon_threadsafe(queue.put_nowait, finished)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+
+        producer = asyncio.ensure_future(run_blocking(produce))
+        try:
+            while True:
+                item = await queue.get()
+                if item is finished:
+                    _check_usage(stats)
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Let an abandoned producer thread stop at the next chunk
+            stopped.set()
+            producer.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+
+class ReplayBackend(ScannerBackend):
+    """
+    Deterministic offline backend serving recorded responses
+
+    Fixtures are `<content_hash>.json` files written by `RecordingBackend`;
+    `default.json` is served for images without a fixture of their own.
+    """
+
+    def __init__(self, fixtures_dir: Path = SCANNER_FIXTURES_DIR, latency: str = SCANNER_REPLAY_LATENCY):
+        self.fixtures_dir = fixtures_dir
+        self.latency = latency
+
+    async def generate(self, prompt: str, prepared: PreparedImage, stats: Optional[ScanStats] = None) -> str:
+        fixture_path = self.fixtures_dir / f"{prepared.content_hash}.json"
+        if not fixture_path.exists():
+            fixture_path = self.fixtures_dir / "default.json"
+        if not fixture_path.exists():
+            raise ValueError(f"No replay fixture for image {prepared.content_hash}")
+
+        async with aiofiles.open(fixture_path, "r") as f:
+            fixture = json.loads(await f.read())
+
+        if self.latency == "recorded":
+            delay = fixture.get("model_latency", 0)
+        else:
+            delay = float(self.latency)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if stats is not None:
+            stats.prompt_tokens = fixture.get("prompt_tokens")
+            stats.response_tokens = fixture.get("response_tokens")
+        metrics.incr("scanner_replayed")
+        return fixture["response_text"]
+
+    async def generate_stream(
+        self,
+        prompt: str,
+        prepared: PreparedImage,
+        stats: Optional[ScanStats] = None
+    ) -> AsyncIterator[str]:
+        # Replays the whole response; artificial latency is applied up front
+        text = await self.generate(prompt, prepared, stats)
+        for start in range(0, len(text), REPLAY_CHUNK_SIZE):
+            yield text[start:start + REPLAY_CHUNK_SIZE]
+            await asyncio.sleep(0)
+
+
+class RecordingBackend(ScannerBackend):
+    """Wraps a real backend and saves each response as a replay fixture"""
+
+    def __init__(self, inner: ScannerBackend, fixtures_dir: Path = SCANNER_FIXTURES_DIR):
+        self.inner = inner
+        self.fixtures_dir = fixtures_dir
+
+    async def generate(self, prompt: str, prepared: PreparedImage, stats: Optional[ScanStats] = None) -> str:
+        stats = stats or ScanStats()
+        started = time.perf_counter()
+        text = await self.inner.generate(prompt, prepared, stats)
+        await self._record(prepared, text, time.perf_counter() - started, stats)
+        return text
+
+    async def generate_stream(
+        self,
+        prompt: str,
+        prepared: PreparedImage,
+        stats: Optional[ScanStats] = None
+    ) -> AsyncIterator[str]:
+        stats = stats or ScanStats()
+        started = time.perf_counter()
+        chunks = []
+        async for chunk in self.inner.generate_stream(prompt, prepared, stats):
+            chunks.append(chunk)
+            yield chunk
+        await self._record(prepared, "".join(chunks), time.perf_counter() - started, stats)
+
+    async def _record(self, prepared: PreparedImage, text: str, latency: float, stats: ScanStats):
+        fixture = {
+            "content_hash": prepared.content_hash,
+            "response_text": text,
+            "model_latency": round(latency, 3),
+            "prompt_tokens": stats.prompt_tokens,
+            "response_tokens": stats.response_tokens,
+            "recorded_at": datetime.utcnow().isoformat()
+        }
+        self.fixtures_dir.mkdir(parents=True, exist_ok=True)
+        async with aiofiles.open(self.fixtures_dir / f"{prepared.content_hash}.json", "w") as f:
+            await f.write(json.dumps(fixture, indent=2, ensure_ascii=False))
+        metrics.incr("scanner_recorded")
+
+
+def backend_requires_api_key() -> bool:
+    """Whether the configured backend needs a Gemini API key"""
+    return SCANNER_BACKEND != "replay"
+
+
+def create_backend(api_key: str) -> ScannerBackend:
+    """Build the configured backend for an API key"""
+    if SCANNER_BACKEND == "replay":
+        return ReplayBackend()
+    if SCANNER_BACKEND == "record":
+        return RecordingBackend(GeminiBackend(api_key))
+    if SCANNER_BACKEND == "gemini":
+        return GeminiBackend(api_key)
+    raise ValueError(f"Unknown SCANNER_BACKEND '{SCANNER_BACKEND}'")
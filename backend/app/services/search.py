@@ -0,0 +1,145 @@
+"""
+Transaction search over merchants, descriptions, tags and line items
+
+Every transaction carries a `search_terms` array with the prefixes of the
+normalized words in its searchable fields. A multikey index on
+(user_id, search_terms) turns a prefix query into an index lookup, so the
+cost depends on the number of matches rather than on the size of the
+user's history. Matches are ranked by which field each query word hit.
+"""
+import os
+import re
+import unicodedata
+from typing import Iterable, List, Optional, Set, Tuple
+
+from .database import get_collection
+
+# Prefixes shorter than this are not indexed (too unselective)
+SEARCH_MIN_PREFIX = 2
+# Longer words are indexed (and matched) by their first characters only
+SEARCH_MAX_PREFIX = 20
+# Terms kept per field, in word order, so a long item list cannot crowd out the rest
+SEARCH_MAX_FIELD_TERMS = 500
+# Most recent matches that are ranked for one query
+SEARCH_CANDIDATE_LIMIT = int(os.getenv("SEARCH_CANDIDATE_LIMIT", "1000"))
+
+# Fields that feed `search_terms`; updates touching them re-index the row
+SEARCH_FIELDS = {"merchant_name", "description", "tags", "items"}
+
+# Projection for reads that do not search
+WITHOUT_SEARCH_TERMS = {"search_terms": 0}
+# Projection of what `search_terms` is computed from
+SEARCH_SOURCE_PROJECTION = {"merchant_name": 1, "description": 1, "tags": 1, "items.name": 1, "updated_at": 1}
+
+# Ranking weight of a query word found in each field (doubled on a whole-word match)
+FIELD_WEIGHTS: Tuple[Tuple[str, float], ...] = (
+    ("merchant_name", 4.0),
+    ("tags", 3.0),
+    ("items", 2.0),
+    ("description", 1.0),
+)
+
+_WORD = re.compile(r"\w+")
+
+
+def fold_text(text: str) -> str:
+    """Case- and accent-fold text ("Café" -> "cafe")"""
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in text if not unicodedata.combining(ch)).casefold()
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Split text into case- and accent-folded words"""
+    if not text:
+        return []
+    return _WORD.findall(fold_text(text))
+
+
+def _field_words(txn: dict, field: str) -> List[str]:
+    if field == "tags":
+        return [word for tag in txn.get("tags") or [] for word in tokenize(tag)]
+    if field == "items":
+        return [word for item in txn.get("items") or [] for word in tokenize(item.get("name"))]
+    return tokenize(txn.get(field))
+
+
+def search_terms(txn: dict) -> List[str]:
+    """Prefixes of every word in the searchable fields of a transaction"""
+    terms: Set[str] = set()
+    for field in SEARCH_FIELDS:
+        field_terms: Set[str] = set()
+        for word in _field_words(txn, field):
+            word = word[:SEARCH_MAX_PREFIX]
+            prefixes = {word[:length] for length in range(SEARCH_MIN_PREFIX, len(word) + 1)}
+            if len(field_terms | prefixes) > SEARCH_MAX_FIELD_TERMS:
+                break
+            field_terms |= prefixes
+        terms |= field_terms
+    return sorted(terms)
+
+
+def with_search_terms(txn: dict) -> dict:
+    """Set `search_terms` on a transaction document and return it"""
+    txn["search_terms"] = search_terms(txn)
+    return txn
+
+
+def touches_search_fields(fields: Iterable[str]) -> bool:
+    """Whether a change to `fields` requires re-indexing"""
+    return not SEARCH_FIELDS.isdisjoint(fields)
+
+
+def query_words(query: str) -> List[str]:
+    """Indexable words of a search query, in order, without duplicates"""
+    words = []
+    for word in tokenize(query):
+        word = word[:SEARCH_MAX_PREFIX]
+        if len(word) >= SEARCH_MIN_PREFIX and word not in words:
+            words.append(word)
+    return words
+
+
+def score(txn: dict, words: List[str]) -> float:
+    """Rank a matching transaction; whole-word hits beat prefix hits"""
+    fields = [(set(_field_words(txn, field)), weight) for field, weight in FIELD_WEIGHTS]
+    total = 0.0
+    for query_word in words:
+        best = 0.0
+        for field_words, weight in fields:
+            if query_word in field_words:
+                best = max(best, weight * 2)
+            elif best < weight and any(word.startswith(query_word) for word in field_words):
+                best = weight
+        total += best
+    return total
+
+
+async def find_matching_transactions(user_id: str, query: str, limit: int, projection: dict) -> List[Tuple[dict, float]]:
+    """
+    Find a user's transactions matching every word of `query` as a prefix
+
+    Args:
+        user_id: Owner of the transactions
+        query: Free text
+        limit: Maximum results
+        projection: Fields to return; the searchable fields are added
+
+    Returns:
+        (transaction, score) pairs, best first, newest first on ties
+    """
+    words = query_words(query)
+    if not words:
+        return []
+
+    transactions_collection = await get_collection("transactions")
+    projection = {**projection, "merchant_name": 1, "description": 1, "tags": 1, "date": 1}
+    if "items" not in projection:
+        projection["items.name"] = 1
+    candidates = await transactions_collection.find(
+        {"user_id": user_id, "search_terms": {"$all": words}},
+        projection
+    ).sort([("date", -1), ("_id", -1)]).limit(SEARCH_CANDIDATE_LIMIT).to_list(length=SEARCH_CANDIDATE_LIMIT)
+
+    # Stable sort keeps the newest-first order among equal scores
+    ranked = sorted(((txn, score(txn, words)) for txn in candidates), key=lambda pair: pair[1], reverse=True)
+    return ranked[:limit]
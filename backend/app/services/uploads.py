@@ -0,0 +1,398 @@
+"""
+Streaming, content-addressed upload storage
+
+Uploads are written to disk in fixed-size chunks while their SHA-256 is
+computed, so memory use stays flat regardless of file size. Files are stored
+once per content hash under `<UPLOAD_DIR>/<h[0:2]>/<h[2:4]>/<hash><ext>`;
+the `upload_blobs` collection counts the receipts referencing each file, and
+a background collector removes files nobody references any more.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import uuid
+import zipfile
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiofiles
+from fastapi import HTTPException, UploadFile, status
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+from .database import get_collection
+
+logger = logging.getLogger(__name__)
+
+# Upload storage
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", "/app/uploads"))
+TMP_DIR = UPLOAD_DIR / "tmp"
+TMP_DIR.mkdir(parents=True, exist_ok=True)
+
+# Upload limits
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(15 * 1024 * 1024)))
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "200"))
+MAX_BATCH_UPLOAD_BYTES = int(os.getenv("MAX_BATCH_UPLOAD_BYTES", str(256 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Room for multipart boundaries and part headers around a single image
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+# Garbage collection of unreferenced files (seconds)
+UPLOAD_GC_INTERVAL = int(os.getenv("UPLOAD_GC_INTERVAL", "3600"))
+UPLOAD_GC_GRACE = int(os.getenv("UPLOAD_GC_GRACE", "86400"))
+
+
+@dataclass
+class StoredUpload:
+    """An upload written to disk"""
+    path: Path
+    size: int
+    content_hash: str
+    extension: str
+
+
+@dataclass
+class BatchUpload:
+    """One file of a batch upload; `upload` is None when it was rejected"""
+    original_name: str
+    upload: Optional[StoredUpload] = None
+    error: Optional[str] = None
+
+
+def sniff_image_type(header: bytes) -> Optional[str]:
+    """
+    Detect an image format from its magic bytes
+
+    Returns:
+        File extension for supported formats, None otherwise
+    """
+    if header.startswith(b"\xff\xd8\xff"):
+        return ".jpg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ".png"
+    if header.startswith((b"GIF87a", b"GIF89a")):
+        return ".gif"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return ".webp"
+    if header.startswith((b"II*\x00", b"MM\x00*")):
+        return ".tiff"
+    if header.startswith(b"BM"):
+        return ".bmp"
+    return None
+
+
+class UploadLimitMiddleware:
+    """
+    Refuse upload requests whose body exceeds the limit of their route
+
+    Multipart bodies are spooled to disk before any handler or dependency
+    runs, so the limit has to apply while the body is received: a larger
+    Content-Length is answered with 413 without reading the body, and
+    chunked bodies are cut off as soon as they pass the limit.
+    """
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        length = Headers(scope=scope).get("content-length")
+        if length and length.isdigit() and int(length) > limit:
+            error = _too_large(limit)
+            response = JSONResponse({"detail": error.detail}, status_code=error.status_code)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise _too_large(limit)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def _too_large(limit: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Upload exceeds the {limit // (1024 * 1024)} MB limit"
+    )
+
+
+async def save_upload(file: UploadFile) -> StoredUpload:
+    """
+    Stream an uploaded image into content-addressed storage
+
+    The stored file holds one reference for the caller, which is expected to
+    attach it to a receipt. The partial file is removed if the upload is
+    rejected.
+
+    Raises:
+        HTTPException: 400 if the data is not an image, 413 if it exceeds
+            MAX_UPLOAD_BYTES
+    """
+    return await save_stream(file.read)
+
+
+async def save_stream(read: Callable[[int], Awaitable[bytes]]) -> StoredUpload:
+    """Stream image bytes from an async `read(size)` callable to storage (see `save_upload`)"""
+    digest = hashlib.sha256()
+    size = 0
+    extension = None
+    tmp_path = TMP_DIR / f"{uuid.uuid4().hex}.part"
+
+    try:
+        async with aiofiles.open(tmp_path, "wb") as out_file:
+            while True:
+                chunk = await read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if extension is None:
+                    extension = sniff_image_type(chunk)
+                    if extension is None:
+                        raise HTTPException(
+                            status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="File must be an image"
+                        )
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise _too_large(MAX_UPLOAD_BYTES)
+                digest.update(chunk)
+                await out_file.write(chunk)
+
+        if extension is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="File is empty"
+            )
+
+        content_hash = digest.hexdigest()
+        final_path = blob_path(content_hash, extension)
+
+        # Take the reference before the file lands so the collector skips it
+        await add_blob_ref(content_hash, final_path, size)
+        final_path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp_path, final_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    return StoredUpload(final_path, size, content_hash, extension)
+
+
+def blob_path(content_hash: str, extension: str) -> Path:
+    """Sharded storage path for a content hash"""
+    return UPLOAD_DIR / content_hash[:2] / content_hash[2:4] / f"{content_hash}{extension}"
+
+
+async def add_blob_ref(content_hash: str, path: Path, size: int):
+    """Count one more receipt referencing a stored file"""
+    blobs_collection = await get_collection("upload_blobs")
+    await blobs_collection.update_one(
+        {"_id": content_hash},
+        {
+            "$inc": {"refcount": 1},
+            "$set": {"path": str(path), "size": size, "updated_at": datetime.utcnow()},
+            "$setOnInsert": {"created_at": datetime.utcnow()}
+        },
+        upsert=True
+    )
+
+
+def _hash_file(path: Path) -> Tuple[str, int]:
+    """SHA-256 and size of a file, read in chunks (blocking)"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+async def adopt_file(path: Path) -> StoredUpload:
+    """
+    Move a file stored before content addressing into blob storage
+
+    Takes one reference for the caller, like `save_upload`. A file whose
+    content is already stored replaces the identical copy.
+    """
+    content_hash, size = await asyncio.to_thread(_hash_file, path)
+    extension = path.suffix.lower() or ".jpg"
+    final_path = blob_path(content_hash, extension)
+    await add_blob_ref(content_hash, final_path, size)
+    if final_path != path:
+        final_path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(path, final_path)
+    return StoredUpload(final_path, size, content_hash, extension)
+
+
+async def release_user_blobs(user_id: str):
+    """Drop the file references held by all receipts of a user"""
+    receipts_collection = await get_collection("receipts")
+    blobs_collection = await get_collection("upload_blobs")
+    cursor = receipts_collection.aggregate([
+        {"$match": {"user_id": user_id, "content_hash": {"$ne": None}}},
+        {"$group": {"_id": "$content_hash", "count": {"$sum": 1}}}
+    ])
+    async for group in cursor:
+        await blobs_collection.update_one(
+            {"_id": group["_id"]},
+            {"$inc": {"refcount": -group["count"]}, "$set": {"updated_at": datetime.utcnow()}}
+        )
+
+
+class UploadGarbageCollector:
+    """
+    Periodically deletes stored files that no receipt references
+
+    A file is removed once its reference count has been zero for the grace
+    period and no receipt points at its hash. Abandoned partial uploads in
+    the temp directory are removed as well.
+    """
+
+    def __init__(self, interval: int = UPLOAD_GC_INTERVAL, grace: int = UPLOAD_GC_GRACE):
+        self.interval = interval
+        self.grace = grace
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the collector loop"""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the collector loop"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                removed = await self.collect()
+                if removed:
+                    logger.info(f"Upload GC removed {removed} unreferenced file(s)")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Upload GC failed: {e}")
+
+    async def collect(self) -> int:
+        """
+        Run one collection pass
+
+        Returns:
+            Number of files removed
+        """
+        blobs_collection = await get_collection("upload_blobs")
+        receipts_collection = await get_collection("receipts")
+        cutoff = datetime.utcnow() - timedelta(seconds=self.grace)
+        removed = 0
+
+        cursor = blobs_collection.find({"refcount": {"$lte": 0}, "updated_at": {"$lt": cutoff}})
+        async for blob in cursor:
+            in_use = await receipts_collection.count_documents({"content_hash": blob["_id"]})
+            if in_use:
+                # Count drifted; receipts still use the file
+                await blobs_collection.update_one({"_id": blob["_id"]}, {"$set": {"refcount": in_use}})
+                continue
+            result = await blobs_collection.delete_one({"_id": blob["_id"], "refcount": {"$lte": 0}})
+            if result.deleted_count == 0:
+                continue
+            path = Path(blob["path"])
+            try:
+                # A concurrent re-upload rewrites the file, giving it a fresh mtime
+                if path.stat().st_mtime < cutoff.timestamp():
+                    path.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                pass
+
+        stale_before = time.time() - self.grace
+        for part in TMP_DIR.glob("*.part"):
+            try:
+                if part.stat().st_mtime < stale_before:
+                    part.unlink()
+            except FileNotFoundError:
+                pass
+
+        return removed
+
+
+upload_gc = UploadGarbageCollector()
+
+
+async def save_batch(files: List[UploadFile]) -> List[BatchUpload]:
+    """
+    Store every image of a batch upload
+
+    Accepts any number of image files or a single zip archive of images.
+    Files that fail validation are reported individually instead of
+    rejecting the whole batch.
+
+    Raises:
+        HTTPException: 400 if the batch holds more than BATCH_MAX_FILES files
+            or the zip archive is corrupt
+    """
+    sources = []
+    archive = None
+    if len(files) == 1 and await _is_zip(files[0]):
+        try:
+            archive = zipfile.ZipFile(files[0].file)
+        except zipfile.BadZipFile:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid zip archive"
+            )
+        for info in archive.infolist():
+            if not info.is_dir() and not Path(info.filename).name.startswith("."):
+                sources.append((info.filename, info))
+    else:
+        sources = [(file.filename, file) for file in files]
+
+    if len(sources) > BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"A batch may contain at most {BATCH_MAX_FILES} files"
+        )
+
+    results = []
+    try:
+        for name, source in sources:
+            try:
+                if archive is not None:
+                    with archive.open(source) as entry:
+                        upload = await save_stream(lambda size: asyncio.to_thread(entry.read, size))
+                else:
+                    upload = await save_upload(source)
+                results.append(BatchUpload(name, upload))
+            except HTTPException as e:
+                results.append(BatchUpload(name, error=e.detail))
+            except (zipfile.BadZipFile, RuntimeError, OSError) as e:
+                results.append(BatchUpload(name, error=f"Could not read file: {e}"))
+    finally:
+        if archive is not None:
+            archive.close()
+    return results
+
+
+async def _is_zip(file: UploadFile) -> bool:
+    header = await file.read(4)
+    await file.seek(0)
+    return header == b"PK\x03\x04"
@@ -0,0 +1,68 @@
+"""Tests for the streamed receipt JSON parser"""
+import json
+
+from app.services.incremental_json import IncrementalObjectParser
+
+RECEIPT = {
+    "merchant_name": "REWE",
+    "total_amount": 12.5,
+    "items": [
+        {"name": "Milk", "total_price": 1.19},
+        {"name": "Bread", "total_price": 2.49}
+    ],
+    "tax_amount": None,
+    "confidence": 0.9
+}
+
+
+def feed_all(chunks):
+    parser = IncrementalObjectParser()
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    return parser, events
+
+
+def test_whole_document_reports_every_field():
+    parser, events = feed_all([json.dumps(RECEIPT)])
+    fields = {key: value for kind, key, value in events if kind == "field"}
+    assert fields == RECEIPT
+    assert parser.done
+
+
+def test_items_are_reported_one_by_one():
+    _, events = feed_all([json.dumps(RECEIPT)])
+    items = [value for kind, key, value in events if kind == "item"]
+    assert items == RECEIPT["items"]
+
+
+def test_every_chunk_boundary_gives_the_same_events():
+    text = json.dumps(RECEIPT, indent=2)
+    _, expected = feed_all([text])
+    for split in range(1, len(text)):
+        _, events = feed_all([text[:split], text[split:]])
+        assert events == expected, f"split at {split}"
+
+
+def test_single_character_chunks():
+    text = json.dumps(RECEIPT)
+    _, expected = feed_all([text])
+    _, events = feed_all(list(text))
+    assert events == expected
+
+
+def test_number_cut_off_mid_stream_is_not_reported_early():
+    parser = IncrementalObjectParser()
+    assert parser.feed('{"total_amount": 12') == []
+    assert parser.feed(".5, ") == [("field", "total_amount", 12.5)]
+
+
+def test_markdown_fence_is_skipped():
+    _, events = feed_all(["```json\n", '{"merchant_name": "Lidl"}', "\n```"])
+    assert events == [("field", "merchant_name", "Lidl")]
+
+
+def test_input_after_the_object_is_ignored():
+    parser = IncrementalObjectParser()
+    parser.feed('{"a": 1}')
+    assert parser.feed('{"b": 2}') == []
@@ -0,0 +1,74 @@
+"""Tests for keyset cursor encoding"""
+import base64
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from app.services.pagination import after_cursor, cursor_for, decode_cursor, encode_cursor
+
+SORT = [("date", -1), ("_id", -1)]
+
+
+def raw_token(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode()).decode().rstrip("=")
+
+
+def assert_invalid(token: str, length: int = 2):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(token, length)
+    assert error.value.status_code == 400
+
+
+def test_round_trip_keeps_bson_types():
+    values = [datetime(2024, 5, 1, 12, 30), ObjectId()]
+    assert decode_cursor(encode_cursor(values), 2) == values
+
+
+def test_token_is_url_safe_without_padding():
+    token = encode_cursor([datetime(2024, 5, 1), ObjectId()])
+    assert "=" not in token
+    assert set(token) <= set("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_")
+
+
+def test_cursor_for_uses_the_sort_fields():
+    doc = {"_id": ObjectId(), "date": datetime(2024, 1, 2), "amount": 5}
+    assert decode_cursor(cursor_for(doc, SORT), 2) == [doc["date"], doc["_id"]]
+
+
+@pytest.mark.parametrize("token", ["", "!!!", "not-base64", raw_token("{}"), raw_token("[1, 2")])
+def test_malformed_tokens_are_rejected(token):
+    assert_invalid(token)
+
+
+def test_wrong_length_is_rejected():
+    assert_invalid(encode_cursor([1, 2, 3]))
+
+
+def test_malformed_object_id_is_rejected():
+    assert_invalid(raw_token('[1, {"$oid": "zz"}]'))
+
+
+def test_after_cursor_builds_keyset_predicate():
+    date, oid = datetime(2024, 1, 2), ObjectId()
+    query = after_cursor({"user_id": "u"}, SORT, encode_cursor([date, oid]))
+    assert query == {
+        "user_id": "u",
+        "$or": [
+            {"date": {"$lt": date}},
+            {"date": date, "_id": {"$lt": oid}}
+        ]
+    }
+
+
+def test_after_cursor_keeps_an_existing_or():
+    query = {"user_id": "u", "$or": [{"a": 1}, {"b": 2}]}
+    result = after_cursor(query, [("_id", 1)], encode_cursor([ObjectId()]))
+    assert result["$and"][0] is query
+    assert list(result["$and"][1]) == ["$or"]
+
+
+def test_no_token_leaves_the_query_alone():
+    query = {"user_id": "u"}
+    assert after_cursor(query, SORT, None) is query
@@ -0,0 +1,59 @@
+"""Tests for search term generation and ranking"""
+from app.services import search
+from app.services.search import fold_text, query_words, score, search_terms, tokenize
+
+
+def test_fold_text_removes_case_and_accents():
+    assert fold_text("Café CRÈME") == "cafe creme"
+
+
+def test_tokenize_splits_on_non_word_characters():
+    assert tokenize("Müller-Brot, 2x!") == ["muller", "brot", "2x"]
+    assert tokenize(None) == []
+
+
+def test_terms_are_prefixes_from_the_minimum_length():
+    assert search_terms({"merchant_name": "Lidl"}) == ["li", "lid", "lidl"]
+
+
+def test_long_words_are_indexed_by_their_first_characters():
+    word = "a" * (search.SEARCH_MAX_PREFIX + 10)
+    terms = search_terms({"description": word})
+    assert max(len(term) for term in terms) == search.SEARCH_MAX_PREFIX
+
+
+def test_terms_cover_every_searchable_field():
+    txn = {
+        "merchant_name": "Rewe",
+        "description": "weekly",
+        "tags": ["groceries"],
+        "items": [{"name": "Oat milk"}]
+    }
+    terms = set(search_terms(txn))
+    assert {"rewe", "weekly", "groceries", "oat", "milk"} <= terms
+
+
+def test_term_cap_applies_per_field_in_word_order(monkeypatch):
+    monkeypatch.setattr(search, "SEARCH_MAX_FIELD_TERMS", 5)
+    txn = {
+        "merchant_name": "Zeta",
+        "items": [{"name": "apple"}, {"name": "banana"}, {"name": "cherry"}]
+    }
+    terms = set(search_terms(txn))
+    # "apple" fits the cap; later items do not, alphabetical order is irrelevant
+    assert {"ap", "app", "appl", "apple"} <= terms
+    assert not {"ba", "ch"} & terms
+    # A long item list never crowds out the other fields
+    assert {"ze", "zet", "zeta"} <= terms
+
+
+def test_query_words_drops_short_and_duplicate_words():
+    assert query_words("a Milk milk Oat") == ["milk", "oat"]
+
+
+def test_whole_word_beats_prefix_and_merchant_beats_description():
+    exact = score({"merchant_name": "Milk bar"}, ["milk"])
+    prefix = score({"merchant_name": "Milkshake"}, ["milk"])
+    description = score({"description": "milk"}, ["milk"])
+    assert exact > prefix
+    assert exact > description